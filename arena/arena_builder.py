@@ -1,23 +1,33 @@
+import concurrent.futures
 import random
 import time
-from itertools import permutations
-from typing import List
+from typing import List, Optional
 
 from contests.templates_factory import build_competition_template
 from entities.competition_task import CompetitionTask
 from entities.experiment import Experiment
+from entities.scheduled_round import ScheduledRound
 from arena.job_queue import DuelsQueue
 from utils.logger import Logger
 from messages.duel_request_message import DuelRequestMessage
-from arena.models import build_model, get_model_name
+from arena.model_registry import ModelRegistry
+from arena.models import get_model_name
+from arena.pairing import build_pairing
 from arena.resumable_arena import ResumableArena
 from arena.storage import Storage
 
 
 class ArenaBuilder:
     logger = Logger()
+    # rounds scheduled up front by an adaptive experiment, before the ranking confidence is checked
+    adaptive_initial_rounds = 2
+    # model clients and their HTTP connections are shared by all experiments of the process
+    model_registry = ModelRegistry()
 
-    def __init__(self, n_rounds: int, model_names: List[str], template_id: str, storage: Storage, duels_queue: DuelsQueue):
+    def __init__(self, n_rounds: int, model_names: List[str], template_id: str, storage: Storage, duels_queue: DuelsQueue,
+                 shared_answers: bool = False, task_per_round: bool = False, adaptive: bool = False,
+                 pairing: Optional[str] = None, pairing_k: Optional[int] = None,
+                 task_concurrency: Optional[int] = None):
         self.n_rounds = n_rounds
         self.model_names = model_names
         self.original_model_names = model_names.copy()
@@ -25,7 +35,15 @@ class ArenaBuilder:
         self.competition_template = build_competition_template(template_id)
         self.storage = storage
         self.duels_queue = duels_queue
+        self.shared_answers = shared_answers
+        self.task_per_round = task_per_round
+        self.adaptive = adaptive
+        self.pairing_id = pairing
+        self.pairing_k = pairing_k
+        self.pairing = build_pairing(pairing, pairing_k)
+        self.task_concurrency = task_concurrency
         self.llms = None
+        self.tasks = None
 
     def create(self):
         is_new = self.__initialize_new_experiment()
@@ -33,7 +51,8 @@ class ArenaBuilder:
             self.__initialize_with_existing_experiment()
 
         arena = ResumableArena(self.storage, self.duels_queue, self.competition_template,
-                               self.llms)
+                               self.llms, next_round=self.__schedule_next_round if self.__is_progressive() else None,
+                               model_registry=self.model_registry)
         return arena
 
     def __initialize_with_existing_experiment(self):
@@ -43,10 +62,25 @@ class ArenaBuilder:
             raise Exception(f'Experiment is created with template "{experiment.template_id}" '
                             f'but the application is executed with "{self.template_id}". '
                             f'You need to finish previous experiment first.')
-        if self.duels_queue.queue.qsize() == 0:
+        self.shared_answers = bool(experiment.shared_answers)
+        self.task_per_round = bool(experiment.task_per_round)
+        self.adaptive = bool(experiment.adaptive)
+        self.pairing_id = experiment.pairing
+        self.pairing_k = experiment.pairing_k
+        self.pairing = build_pairing(experiment.pairing, experiment.pairing_k)
+        if self.duels_queue.queue.qsize() == 0 and not self.__is_progressive():
             self.logger.info(
                 'WARN: Processing queue for the experiment is empty. It seems the experiment is completed.')
-        self.llms = [build_model(model) for model in experiment.model_names]
+        self.llms = [self.model_registry.get_model(model) for model in experiment.model_names]
+        self.model_names = [get_model_name(model) for model in self.llms]
+        self.original_model_names = list(experiment.model_names)
+        n_tasks = len(self.model_names)
+        tasks = self.__get_stored_tasks(n_tasks)
+        if len(tasks) == n_tasks:
+            self.tasks = [tasks[n + 1] for n in range(n_tasks)]
+        else:
+            # experiments created before tasks were numbered have them in the order of generation
+            self.tasks = [task.task_description for task in self.storage.get_tasks() if task.task_num is None]
 
     def __initialize_new_experiment(self):
         experiment = self.storage.get_experiment()
@@ -56,15 +90,14 @@ class ArenaBuilder:
         if experiment:
             self.storage.delete_experiment()
 
-        self.llms = [build_model(model) for model in self.model_names]
+        self.llms = [self.model_registry.get_model(model) for model in self.model_names]
         # re-create model names with formal names used in created objects
         self.model_names = [get_model_name(model) for model in self.llms]
 
         n_llms = len(self.model_names)
         if n_llms < 2:
             raise Exception('Too small number of LLMs. At least two should be provided to start a competition.')
-        all_pairs = list(permutations(self.model_names, 2))
-        n_pairs_in_round = len(all_pairs)
+        n_pairs_in_round = self.pairing.get_n_pairs(n_llms)
         n_duels = self.n_rounds * n_pairs_in_round
 
         experiment = Experiment()
@@ -74,13 +107,19 @@ class ArenaBuilder:
         experiment.n_rounds = self.n_rounds
         experiment.n_pairs_in_round = n_pairs_in_round
         experiment.n_duels = n_duels
+        experiment.shared_answers = self.shared_answers
+        experiment.task_per_round = self.task_per_round
+        experiment.adaptive = self.adaptive
+        experiment.pairing = self.pairing_id
+        experiment.pairing_k = self.pairing_k
         self.storage.save_experiment(experiment)
 
-        tasks = self.__build_tasks(n_llms)
-        self.__build_duel_requests(experiment, tasks, all_pairs)
+        self.tasks = self.__build_tasks(n_llms)
+        duel_requests, scheduled_rounds = self.__build_duel_requests(experiment)
 
+        # duels are queued in the same transaction which completes the experiment, so it's never half initialized
         experiment.initialized = True
-        self.storage.save_experiment(experiment)
+        self.storage.save_experiment(experiment, scheduled_rounds, self.duels_queue.get_insert(duel_requests))
         return True
 
     def __build_tasks(self, n_tasks):
@@ -89,42 +128,139 @@ class ArenaBuilder:
             raise AssertionError('Number of tasks should be a multiple of the number of models.')
         self.logger.info(f'Models under evaluation: {self.model_names}')
         self.logger.info(f'Generate {n_tasks} tasks for the competition.')
-        tasks = []
-        for n in range(n_tasks):
-            model_index = n % n_llms
-            original_model_name = self.original_model_names[model_index]
-            llm = self.llms[model_index]
-            self.logger.info(f'Querying model: {original_model_name}')
-
-            try:
-                task = ResumableArena.invoke_chat(f'Task #{n + 1}', chat=llm,
-                                                  template=self.competition_template.get_task_selection_template())
-            except Exception as ex:
-                raise Exception(f'Cannot get task from the model {original_model_name}. Error: {ex}')
-
-            competition_task = CompetitionTask()
-            competition_task.task_description = task
-            competition_task.created_by_model = original_model_name
-            self.storage.save_task(competition_task)
-
-            tasks.append(task)
+        # tasks saved before the initialization was interrupted are not requested again
+        tasks = self.__get_stored_tasks(n_tasks)
+        if tasks:
+            self.logger.info(f'Using {len(tasks)} tasks generated before.')
+        missing_task_nums = [n + 1 for n in range(n_tasks) if n + 1 not in tasks]
+        if ResumableArena.cost_tracker:
+            ResumableArena.cost_tracker.sync(self.storage.get_total_cost())
+        max_workers = self.task_concurrency or n_llms
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.__build_task, task_num): task_num for task_num in missing_task_nums}
+            errors = []
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    tasks[futures[future]] = future.result()
+                except Exception as ex:
+                    errors.append(ex)
+        if errors:
+            raise errors[0]
         self.logger.info('Done')
-        return tasks
+        return [tasks[n + 1] for n in range(n_tasks)]
+
+    def __get_stored_tasks(self, n_tasks):
+        """Descriptions of saved tasks by task number, one for each number. Only tasks created by the model
+        which generates the number are used, others are left by an earlier experiment in the database."""
+        n_llms = len(self.original_model_names)
+        return {task.task_num: task.task_description for task in self.storage.get_tasks()
+                if task.task_num is not None and task.task_num <= n_tasks
+                and task.created_by_model == self.original_model_names[(task.task_num - 1) % n_llms]}
+
+    def __build_task(self, task_num):
+        model_index = (task_num - 1) % len(self.model_names)
+        original_model_name = self.original_model_names[model_index]
+        llm = self.llms[model_index]
+        tracker = ResumableArena.cost_tracker
+        if tracker and tracker.is_exceeded():
+            raise Exception(f'Budget reached: {tracker.get_summary()}. Task #{task_num} is not generated, '
+                            f'the experiment is initialized when it is run with a higher budget.')
+        self.logger.info(f'Querying model: {original_model_name}')
 
-    def __build_duel_requests(self, experiment: Experiment, tasks, all_pairs):
+        try:
+            task, usage = ResumableArena.invoke_chat_with_usage(
+                f'Task #{task_num}', chat=llm, template=self.competition_template.get_task_selection_template(),
+                cache_scope=f'task_{task_num}')
+        except Exception as ex:
+            raise Exception(f'Cannot get task from the model {original_model_name}. Error: {ex}')
+
+        competition_task = CompetitionTask()
+        competition_task.task_description = task
+        competition_task.created_by_model = original_model_name
+        competition_task.task_num = task_num
+        ResumableArena.set_usage(competition_task, usage)
+        self.storage.save_task(competition_task)
+        ResumableArena.mark_stored(competition_task)
+        return task
+
+    def __build_duel_requests(self, experiment: Experiment):
         self.logger.info(f'Scheduling duels for competition: {self.competition_template.get_template_name()}')
         self.logger.info(f'Number of rounds: {self.n_rounds}')
         self.logger.info(f'Number of duels: {experiment.n_duels} ({experiment.n_pairs_in_round} in each round)')
 
-        n_llms = len(self.llms)
-        for n in range(self.n_rounds):
-            self.logger.info(f'.. round {n + 1}')
-            for master_model, student_model in all_pairs:
-                task_index = random.randrange(0, n_llms)
-                task = tasks[task_index]
-                duel_request = DuelRequestMessage(master_model=master_model, student_model=student_model,
-                                                  template_id=self.template_id, task=task, task_num=task_index+1)
-                self.duels_queue.add(duel_request)
+        if self.shared_answers:
+            self.logger.info(f'Each student answers its task once per round ({len(self.model_names)} answers per round)')
+
+        n_rounds = self.n_rounds
+        if self.pairing.requires_standings:
+            n_rounds = 1
+            self.logger.info(f'Pairing "{self.pairing_id}" depends on standings, rounds are scheduled one by one.')
+        elif self.adaptive:
+            n_rounds = min(self.n_rounds, self.adaptive_initial_rounds)
+            self.logger.info(f'Adaptive experiment, scheduling {n_rounds} rounds first. Next rounds are scheduled '
+                             f'only for models whose ranking is uncertain.')
+        duel_requests, scheduled_rounds = [], []
+        for n in range(n_rounds):
+            round_requests, scheduled_round = self.__build_round(n + 1, self.model_names)
+            duel_requests.extend(round_requests)
+            scheduled_rounds.append(scheduled_round)
+        return duel_requests, scheduled_rounds
+
+    def __is_progressive(self):
+        return self.adaptive or self.pairing.requires_standings
+
+    def __schedule_next_round(self, arena: ResumableArena) -> bool:
+        experiment = self.storage.get_experiment()
+        n_scheduled = len(self.storage.get_scheduled_rounds())
+        if n_scheduled >= experiment.n_rounds:
+            self.logger.info(f'All {experiment.n_rounds} rounds are done.')
+            return False
+        student_models = self.model_names
+        if self.adaptive and n_scheduled >= self.adaptive_initial_rounds:
+            self.logger.info(f'Checking confidence of the ranking after {n_scheduled} rounds:')
+            student_models = arena.get_uncertain_models()
+            if not student_models:
+                self.logger.info(f'Ranking is confident after {n_scheduled} rounds, skipping '
+                                 f'{experiment.n_rounds - n_scheduled} remaining rounds.')
+                return False
+            self.logger.info(f'Ranking of {student_models} is uncertain.')
+        standings = arena.get_standings() if self.pairing.requires_standings else None
+        duel_requests, scheduled_round = self.__build_round(n_scheduled + 1, student_models, standings)
+        self.storage.save_scheduled_round(scheduled_round, self.duels_queue.get_insert(duel_requests))
+        return True
+
+    def __build_round(self, round_num, student_models: List[str], standings=None):
+        """Duels of pairs chosen by the pairing strategy, only with the given students
+        (students of an adaptive round are the uncertain models)"""
+        self.logger.info(f'.. round {round_num}')
+        n_llms = len(self.model_names)
+        pairs = [(master_model, student_model)
+                 for master_model, student_model in self.pairing.get_pairs(self.model_names, round_num, standings)
+                 if student_model in student_models]
+        student_tasks = None
+        if self.task_per_round:
+            # all duels in the round are about the same task, so masters can evaluate answers in batches
+            round_task = random.randrange(0, n_llms)
+            student_tasks = {model: round_task for model in self.model_names}
+        elif self.shared_answers:
+            # every student gets the same task from all masters in the round
+            student_tasks = {model: random.randrange(0, n_llms) for model in self.model_names}
+        duel_requests = []
+        for master_model, student_model in pairs:
+            task_index = student_tasks[student_model] if student_tasks else random.randrange(0, n_llms)
+            task = self.tasks[task_index]
+            answer_key = f'{round_num}/{student_model}/{task_index + 1}' if self.shared_answers else None
+            duel_request = DuelRequestMessage(master_model=master_model, student_model=student_model,
+                                              template_id=self.template_id, task=task, task_num=task_index+1,
+                                              round_num=round_num, answer_key=answer_key)
+            duel_requests.append(duel_request)
+
+        scheduled_round = ScheduledRound()
+        scheduled_round.round_num = round_num
+        scheduled_round.created_ts = time.time_ns() // 1_000
+        scheduled_round.n_duels = len(pairs)
+        scheduled_round.student_models = list(student_models)
+        return duel_requests, scheduled_round
 
     @staticmethod
     def __check_missing(variable, attribute_name):
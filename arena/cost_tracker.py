@@ -0,0 +1,89 @@
+import json
+import threading
+from typing import Dict, Optional
+
+from utils.logger import Logger
+
+
+class CostTracker:
+    """Tokens and cost of model calls, with prices per million input and output tokens for each model, e.g.
+    {"gpt-4o": {"input": 2.5, "output": 10.0}}. A price applies to the model of the same name, or to models
+    whose names start with it (the longest matching prefix), so "gpt-4o" prices "gpt-4o-2024-08-06" too.
+    When `budget` is set, the experiment is paused once the cost of the experiment reaches it."""
+
+    logger = Logger()
+
+    def __init__(self, prices: Dict[str, Dict[str, float]], budget: Optional[float] = None):
+        self.prices = prices
+        self.budget = budget
+        # cost of calls stored in the experiment database (also by other workers), and of calls made
+        # by this process which aren't stored (yet, or ever, like calls of failed duels)
+        self.stored_cost = 0.0
+        self.live_cost = 0.0
+        self.costs = {}
+        self.tokens = {}
+        self.unpriced_models = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_json_file(file_name, budget: Optional[float] = None):
+        with open(file_name, 'r') as file:
+            return CostTracker(json.load(file), budget)
+
+    def get_price(self, model_name) -> Optional[Dict[str, float]]:
+        if model_name in self.prices:
+            return self.prices[model_name]
+        prefixes = [prefix for prefix in self.prices if model_name.startswith(prefix)]
+        return self.prices[max(prefixes, key=len)] if prefixes else None
+
+    def add(self, model_name, input_tokens: int, output_tokens: int) -> Optional[float]:
+        """Records tokens of a call and returns its cost, or None when the model has no price"""
+        price = self.get_price(model_name)
+        cost = None
+        if price is not None:
+            cost = (input_tokens * price.get('input', 0.0) + output_tokens * price.get('output', 0.0)) / 1e6
+        with self.lock:
+            tokens = self.tokens.setdefault(model_name, [0, 0])
+            tokens[0] += input_tokens
+            tokens[1] += output_tokens
+            if cost is not None:
+                self.live_cost += cost
+                self.costs[model_name] = self.costs.get(model_name, 0.0) + cost
+            elif model_name not in self.unpriced_models:
+                self.unpriced_models.add(model_name)
+                self.logger.info(f'WARN: Model {model_name} has no price, its calls are not counted in the cost.')
+        return cost
+
+    def mark_stored(self, cost: float):
+        """Moves cost of a call from the live cost to the stored cost, once its entity is stored"""
+        with self.lock:
+            self.live_cost -= cost
+            self.stored_cost += cost
+
+    def sync(self, stored_cost: float):
+        """Continues from the cost stored in the experiment database, which includes calls of other workers,
+        keeping the cost of calls of this process which aren't stored"""
+        with self.lock:
+            self.stored_cost = stored_cost
+
+    def get_total_cost(self) -> float:
+        with self.lock:
+            return self.stored_cost + self.live_cost
+
+    def is_exceeded(self) -> bool:
+        return self.budget is not None and self.get_total_cost() >= self.budget
+
+    def get_summary(self) -> str:
+        summary = f'${self.get_total_cost():.4f}'
+        if self.budget is not None:
+            summary += f' of ${self.budget:.2f} budget'
+        return summary
+
+    def show_stats(self):
+        with self.lock:
+            items = sorted(self.tokens.items(), key=lambda item: -self.costs.get(item[0], 0.0))
+            costs = dict(self.costs)
+        self.logger.info(f'Cost of the experiment: {self.get_summary()}, calls of this run:')
+        for model_name, (input_tokens, output_tokens) in items:
+            cost = f'${costs[model_name]:.4f}' if model_name in costs else 'no price'
+            self.logger.info(f'   > {model_name}: {input_tokens} input and {output_tokens} output tokens, {cost}')
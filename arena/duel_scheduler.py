@@ -0,0 +1,95 @@
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from messages.duel_request_message import DuelRequestMessage
+from arena.models import get_provider
+
+
+class DuelScheduler:
+    """Picks the next group of duels to dispatch from a window of leased queue messages.
+    Messages are leased from the queue only for free worker slots plus a small `prefetch` window, so a crash
+    leaves just a few locked messages behind.
+    It keeps the number of duels in flight for each provider and prefers duels whose student and master providers
+    are the least busy, so all backends are kept busy instead of processing the queue in FIFO order.
+    With `provider_concurrency` set, a provider never has more duels in flight than the limit."""
+
+    def __init__(self, fetch: Callable[[], List[List[DuelRequestMessage]]], prefetch: int,
+                 provider_concurrency: Optional[int] = None):
+        self.fetch = fetch
+        self.prefetch = prefetch
+        self.provider_concurrency = provider_concurrency
+        self.buffer = deque()
+        self.in_flight = {}
+        self.providers = {}
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    def next_group(self, free_slots: int) -> Optional[List[DuelRequestMessage]]:
+        self.__fill_buffer(free_slots + self.prefetch)
+        with self.lock:
+            best_index, best_load = None, None
+            for index, group in enumerate(self.buffer):
+                loads = [self.in_flight.get(provider, 0) for provider in self.__get_providers(group)]
+                if self.provider_concurrency and max(loads) >= self.provider_concurrency:
+                    continue
+                if best_load is None or max(loads) < best_load:
+                    best_index, best_load = index, max(loads)
+                    if best_load == 0:
+                        break
+            if best_index is None:
+                return None
+            group = self.buffer[best_index]
+            del self.buffer[best_index]
+            for provider in self.__get_providers(group):
+                self.in_flight[provider] = self.in_flight.get(provider, 0) + 1
+            return group
+
+    def release(self, group: List[DuelRequestMessage]):
+        with self.lock:
+            for provider in self.__get_providers(group):
+                self.in_flight[provider] -= 1
+
+    def is_exhausted(self) -> bool:
+        with self.lock:
+            return self.exhausted and not self.buffer
+
+    def drain(self) -> List[DuelRequestMessage]:
+        """Removes and returns messages leased ahead and not dispatched yet"""
+        with self.lock:
+            messages = [message for group in self.buffer for message in group]
+            self.buffer.clear()
+            return messages
+
+    def get_in_flight_counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.in_flight)
+
+    def get_in_flight(self) -> str:
+        with self.lock:
+            return ', '.join(f'{provider}={count}' for provider, count in sorted(self.in_flight.items()) if count)
+
+    def __fill_buffer(self, n_groups):
+        with self.lock:
+            n_missing = n_groups - len(self.buffer)
+        while n_missing > 0:
+            groups = self.fetch()
+            with self.lock:
+                self.exhausted = not groups
+                self.buffer.extend(groups)
+            if not groups:
+                break
+            n_missing -= len(groups)
+
+    def __get_providers(self, group: List[DuelRequestMessage]):
+        models = {message.student_model for message in group} | {message.master_model for message in group}
+        return {self.__get_provider(model) for model in models}
+
+    def __get_provider(self, model_name):
+        if model_name not in self.providers:
+            try:
+                self.providers[model_name] = get_provider(model_name)
+            except Exception:
+                # unknown models are treated as separate backends
+                self.providers[model_name] = model_name
+        return self.providers[model_name]
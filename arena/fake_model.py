@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, List, Optional
+from urllib.parse import parse_qsl
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+# every response starts with the prefix, answers (responses to prompts with a task written by a fake model)
+# end with the quality marker of the student, which can't appear in tasks or in model names
+text_prefix = 'Fake text by '
+quality_marker = re.compile(r'<fake quality: ([0-9.]+)>')
+# headers of the answer sections of evaluation prompts
+answer_header = re.compile(r'answer to evaluate:|answer in the competition is:', re.IGNORECASE)
+batch_answer_header = re.compile(r'^\s*Answer \d+:\s*$', re.MULTILINE)
+
+
+class FakeChatModel(BaseChatModel):
+    """Local chat model simulating a provider, for tests and benchmarks without API calls.
+    It's built for model names like `fake/<name>?latency=0.2&rate_limit=0.01`, with parameters:
+
+    * latency - median response time in seconds, drawn from a log-normal distribution with `sigma`,
+    * tokens - number of tokens of answers,
+    * rate_limit, unavailable - probability of 429 and 503 errors,
+    * malformed - probability of a score response which isn't valid JSON,
+    * quality - scores received as a student (default drawn from the name), strictness - lowered scores as a master.
+
+    Contents of responses are deterministic for the same prompt, only latency and errors are random."""
+
+    model: str
+    temperature: float = 1.0
+    latency: float = 0.0
+    sigma: float = 0.5
+    tokens: int = 200
+    rate_limit: float = 0.0
+    unavailable: float = 0.0
+    malformed: float = 0.0
+    quality: Optional[float] = None
+    strictness: float = 0.0
+    seed: int = 0
+    _rng: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if self.quality is None:
+            self.quality = 0.3 + 0.6 * self.__get_hash_fraction(self.model)
+        self._rng = random.Random(f'{self.seed}/{self.model}')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_model_name(model_name, temperature=1.0) -> 'FakeChatModel':
+        params = dict(parse_qsl(model_name.partition('?')[2]))
+        return FakeChatModel(model=model_name, temperature=temperature, **params)
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake'
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        delay, error = self.__draw_outcome()
+        time.sleep(delay)
+        return self.__respond(messages, error)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        delay, error = self.__draw_outcome()
+        await asyncio.sleep(delay)
+        return self.__respond(messages, error)
+
+    def __draw_outcome(self):
+        with self._lock:
+            delay = self.latency * self._rng.lognormvariate(0.0, self.sigma) if self.latency > 0 else 0.0
+            draw = self._rng.random()
+            malformed = self._rng.random() < self.malformed
+        if draw < self.rate_limit:
+            return delay, 'Error code: 429 - rate_limit_error (simulated)'
+        if draw < self.rate_limit + self.unavailable:
+            return delay, 'Error code: 503 - service unavailable (simulated)'
+        return delay, 'malformed' if malformed else None
+
+    def __respond(self, messages: List[BaseMessage], error: Optional[str]) -> ChatResult:
+        if error and error != 'malformed':
+            raise Exception(error)
+        prompt = '\n'.join(str(message.content) for message in messages)
+        if 'json' in prompt.lower():
+            content = self.__score(prompt)
+            if error == 'malformed':
+                content = content.replace('"', '').replace(':', ' =')
+        else:
+            content = self.__answer(prompt)
+        n_input_tokens = len(prompt) // 4
+        n_output_tokens = len(content) // 4
+        message = AIMessage(content=content, usage_metadata={'input_tokens': n_input_tokens,
+                                                              'output_tokens': n_output_tokens,
+                                                              'total_tokens': n_input_tokens + n_output_tokens})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def __answer(self, prompt):
+        rng = random.Random(self.__get_hash_fraction(self.model + prompt))
+        words = ' '.join(f'word{rng.randrange(1000)}' for _ in range(max(self.tokens - 8, 1)))
+        text = f'{text_prefix}{self.model.partition("?")[0]}: {words}'
+        if text_prefix not in prompt:
+            return text
+        # quality of the student is passed in the answer, so masters can score it
+        return f'{text} <fake quality: {self.quality:.3f}>'
+
+    def __score(self, prompt):
+        example = re.search(r'\{\s*"[^{}]*\}', prompt[prompt.find('xample'):])
+        metric_keys = list(json.loads(example.group(0)).keys()) if example else ['score']
+        rng = random.Random(self.__get_hash_fraction(self.model + prompt))
+        scores = [{key: round(min(1.0, max(0.0, quality - self.strictness + rng.gauss(0.0, 0.1))), 2)
+                   for key in metric_keys} for quality in self.__get_answer_qualities(prompt)]
+        if 'json array' in prompt.lower():
+            return json.dumps(scores)
+        return json.dumps(scores[0])
+
+    @staticmethod
+    def __get_answer_qualities(prompt):
+        # only answer sections are read, the task before them may be written by a fake model too
+        if 'json array' in prompt.lower():
+            sections = batch_answer_header.split(prompt)[1:]
+        else:
+            headers = list(answer_header.finditer(prompt))
+            sections = [prompt[headers[-1].end():]] if headers else []
+        qualities = []
+        for section in sections or ['']:
+            marker = quality_marker.search(section)
+            qualities.append(float(marker.group(1)) if marker else 0.5)
+        return qualities
+
+    @staticmethod
+    def __get_hash_fraction(text):
+        return int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:12], 16) / 16 ** 12
@@ -1,18 +1,30 @@
-from typing import Optional
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
 
-from litequeue import LiteQueue
+from litequeue import LiteQueue, MessageStatus, uuid7
 
 from messages.duel_request_message import DuelRequestMessage
 from utils.logger import Logger
 
 
 class DuelsQueue:
+    """Queue of duel requests. When `lease_timeout` (seconds) is set, a popped message is leased by this process:
+    the lease is renewed by heartbeats and only leases which were not renewed in time are reclaimed, so many workers
+    can share the queue. The lock time of a message is used as a fencing token, a worker which lost its lease
+    cannot acknowledge the message anymore."""
     logger = Logger()
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, lease_timeout: Optional[float] = None):
         self.db_path = db_path
         self.queue = LiteQueue(filename_or_conn=db_path, memory=False, queue_name="duels_queue")
+        # the database is shared with the storage, wait for its writers instead of failing with "database is locked"
+        self.queue.conn.execute('PRAGMA busy_timeout = 60000')
         self.cnt_retried = 0
+        self.lease_timeout = lease_timeout
+        self.leases = {}
+        self.lock = threading.RLock()
 
     def __del__(self):
         self.prune(include_failed=False)
@@ -24,46 +36,153 @@ class DuelsQueue:
         self.queue.prune(include_failed)
 
     def add(self, queue_item: DuelRequestMessage):
-        self.queue.put(queue_item.json())
+        self.add_many([queue_item])
+
+    def add_many(self, queue_items: Iterable[DuelRequestMessage]):
+        statement, rows = self.get_insert(queue_items)
+        with self.lock, self.queue.transaction(mode='IMMEDIATE'):
+            self.queue.conn.executemany(statement, rows)
+
+    def get_insert(self, queue_items: Iterable[DuelRequestMessage]) -> Tuple[str, List[dict]]:
+        """Statement and its rows adding messages to the queue. It can be executed by another connection
+        to the experiment database, so messages are committed along with other changes."""
+        now = time.time_ns()
+        # consecutive insertion times keep the order of messages
+        rows = [{'data': queue_item.json(), 'message_id': uuid7(), 'in_time': now + n}
+                for n, queue_item in enumerate(queue_items)]
+        statement = (f'INSERT INTO {self.queue.table} (data, message_id, status, in_time, lock_time, done_time) '
+                     f'VALUES (:data, :message_id, {MessageStatus.READY.value}, :in_time, NULL, NULL)')
+        return statement, rows
 
     def get(self) -> Optional[DuelRequestMessage]:
-        task = self.queue.pop()
-        if not task:
-            if self.cnt_retried > 1:
-                return None
-            self.cnt_retried += 1
-            self.retry_failed()
+        with self.lock:
             task = self.queue.pop()
             if not task:
-                return None
+                if self.cnt_retried > 1:
+                    return None
+                self.cnt_retried += 1
+                self.retry_failed()
+                task = self.queue.pop()
+                if not task:
+                    return None
+            if self.lease_timeout:
+                self.leases[task.message_id] = task.lock_time
         duel_request = DuelRequestMessage.model_validate_json(task.data)
         duel_request.message_id = task.message_id
         return duel_request
 
     def mark_failed(self, duel_request):
         message_id = duel_request.message_id
-        self.queue.mark_failed(message_id)
+        with self.lock:
+            if self.lease_timeout:
+                self.__complete_lease(message_id, MessageStatus.FAILED)
+            else:
+                self.queue.mark_failed(message_id)
 
     def mark_done(self, duel_request):
-        message_id = duel_request.message_id
-        self.queue.done(message_id)
+        self.done_many([duel_request])
+
+    def done_many(self, duel_requests: Iterable[DuelRequestMessage]):
+        with self.lock, self.queue.transaction(mode='IMMEDIATE'):
+            for duel_request in duel_requests:
+                if self.lease_timeout:
+                    self.__complete_lease(duel_request.message_id, MessageStatus.DONE)
+                else:
+                    self.queue.done(duel_request.message_id)
+
+    def retry_many(self, message_ids: Iterable[str]):
+        with self.lock, self.queue.transaction(mode='IMMEDIATE'):
+            for message_id in message_ids:
+                self.queue.retry(message_id)
+
+    def release_many(self, duel_requests: Iterable[DuelRequestMessage]):
+        """Returns leased messages to the queue without processing them, ready to be taken by any worker"""
+        with self.lock, self.queue.transaction(mode='IMMEDIATE'):
+            for duel_request in duel_requests:
+                message_id = duel_request.message_id
+                if not self.lease_timeout:
+                    self.queue.retry(message_id)
+                    continue
+                self.queue.conn.execute(
+                    f'UPDATE {self.queue.table} SET status = {MessageStatus.READY.value}, done_time = NULL '
+                    f'WHERE message_id = :message_id AND status = {MessageStatus.LOCKED.value} '
+                    f'AND lock_time = :lock_time',
+                    {'message_id': message_id, 'lock_time': self.leases.pop(message_id, None)})
+
+    def heartbeat(self):
+        with self.lock:
+            for message_id, lock_time in list(self.leases.items()):
+                new_lock_time = time.time_ns()
+                cursor = self.queue.conn.execute(
+                    f'UPDATE {self.queue.table} SET lock_time = :new_lock_time '
+                    f'WHERE message_id = :message_id AND status = {MessageStatus.LOCKED.value} '
+                    f'AND lock_time = :lock_time',
+                    {'new_lock_time': new_lock_time, 'message_id': message_id, 'lock_time': lock_time})
+                if cursor.rowcount == 1:
+                    self.leases[message_id] = new_lock_time
+                else:
+                    self.logger.info(f'WARN: Lease of message {message_id} expired and was taken over.')
+                    del self.leases[message_id]
+
+    @contextmanager
+    def keep_leases_alive(self):
+        if not self.lease_timeout:
+            yield
+            return
+        stopped = threading.Event()
+
+        def renew_leases():
+            while not stopped.wait(self.lease_timeout / 3):
+                self.heartbeat()
+
+        thread = threading.Thread(target=renew_leases, name='lease-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def __complete_lease(self, message_id, status: MessageStatus):
+        lock_time = self.leases.pop(message_id, None)
+        cursor = self.queue.conn.execute(
+            f'UPDATE {self.queue.table} SET status = {status.value}, done_time = :now '
+            f'WHERE message_id = :message_id AND status = {MessageStatus.LOCKED.value} AND lock_time = :lock_time',
+            {'now': time.time_ns(), 'message_id': message_id, 'lock_time': lock_time})
+        if cursor.rowcount != 1:
+            self.logger.info(f'WARN: Lease of message {message_id} was lost, the message is owned by another worker.')
 
     def retry_failed(self):
-        failed_messages = list(self.queue.list_failed())
-        n_failed = len(failed_messages)
+        # a single statement, so a message retried and taken by another worker in the meantime is not reset
+        with self.lock:
+            n_failed = self.queue.conn.execute(
+                f'UPDATE {self.queue.table} SET status = {MessageStatus.READY.value}, done_time = NULL '
+                f'WHERE status = {MessageStatus.FAILED.value}').rowcount
         if n_failed > 0:
             self.logger.info(f'Found {n_failed} failed messages. Retrying all of them...')
-            for message in failed_messages:
-                self.queue.retry(message.message_id)
             return True
         return False
 
     def retry_locked(self):
+        if self.lease_timeout:
+            return self.retry_expired()
         locked_messages = list(self.queue.list_locked(0))
         n_locked = len(locked_messages)
         if n_locked > 0:
             self.logger.info(f'Found {n_locked} locked messages. Retrying all of them...')
-            for message in locked_messages:
-                self.queue.retry(message.message_id)
+            self.retry_many([message.message_id for message in locked_messages])
+            return True
+        return False
+
+    def retry_expired(self):
+        # a single statement, so a lease renewed by its owner in the meantime is not reclaimed
+        expired_lock_time = time.time_ns() - int(self.lease_timeout * 1e9)
+        with self.lock:
+            n_expired = self.queue.conn.execute(
+                f'UPDATE {self.queue.table} SET status = {MessageStatus.READY.value}, done_time = NULL '
+                f'WHERE status = {MessageStatus.LOCKED.value} AND lock_time < :expired_lock_time',
+                {'expired_lock_time': expired_lock_time}).rowcount
+        if n_expired > 0:
+            self.logger.info(f'Found {n_expired} messages with expired lease. Retrying all of them...')
             return True
         return False
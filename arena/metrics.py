@@ -0,0 +1,139 @@
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from utils.logger import Logger
+
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+commit_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Metrics:
+    """Counters, gauges and histograms of a running experiment, with labels (e.g. model, role), rendered
+    in the Prometheus text format. Events (counters and histograms) are also written to a JSONL trace file,
+    when it's given, one line per event with its time, name, value and labels."""
+
+    logger = Logger()
+    # histograms of durations shorter than a model call
+    buckets = {'arena_storage_commit_seconds': commit_buckets}
+
+    def __init__(self, trace_file: Optional[str] = None):
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self.gauges: Dict[Tuple[str, tuple], float] = {}
+        # histogram: bucket counts (the last one is +Inf), sum and count of observed values
+        self.histograms: Dict[Tuple[str, tuple], list] = {}
+        self.lock = threading.Lock()
+        self.trace = open(trace_file, 'a', buffering=1) if trace_file else None
+
+    def inc(self, name, value=1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+        self.__trace(name, value, labels)
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets.get(name, latency_buckets)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self.__trace(name, value, labels)
+
+    def __trace(self, name, value, labels):
+        if self.trace:
+            line = json.dumps({'ts': time.time(), 'name': name, 'value': value, **labels})
+            with self.lock:
+                self.trace.write(line + '\n')
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self.histograms.items())
+        self.__render_values(lines, 'counter', counters)
+        self.__render_values(lines, 'gauge', gauges)
+        last_name = None
+        for (name, labels), (counts, total, count) in histograms:
+            if name != last_name:
+                lines.append(f'# TYPE {name} histogram')
+                last_name = name
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets.get(name, latency_buckets) + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{self.__labels_to_str(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{self.__labels_to_str(labels)} {total}')
+            lines.append(f'{name}_count{self.__labels_to_str(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def __render_values(self, lines, kind, values):
+        last_name = None
+        for (name, labels), value in values:
+            if name != last_name:
+                lines.append(f'# TYPE {name} {kind}')
+                last_name = name
+            lines.append(f'{name}{self.__labels_to_str(labels)} {value}')
+
+    @staticmethod
+    def __labels_to_str(labels):
+        if not labels:
+            return ''
+        escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                   for key, value in labels]
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    def close(self):
+        if self.trace:
+            with self.lock:
+                self.trace.close()
+                self.trace = None
+
+
+class MetricsServer:
+    """HTTP endpoint serving metrics at `/metrics` in a background thread"""
+
+    logger = Logger()
+
+    def __init__(self, metrics: Metrics, port: int, host='127.0.0.1'):
+        self.metrics = metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        self.logger.info(f'Metrics are served at http://{host}:{port}/metrics')
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
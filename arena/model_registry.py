@@ -0,0 +1,91 @@
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Dict, Tuple
+
+import httpx
+
+from arena.models import build_model, get_provider
+from utils.logger import Logger
+
+
+class EventLoopTransport(httpx.AsyncBaseTransport):
+    """Async connections belong to the event loop which opened them, and the async engine runs a new loop
+    for every part of the queue, so a pool of connections is kept per running loop"""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.transports = weakref.WeakKeyDictionary()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        transport = self.transports.get(loop)
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(**self.kwargs)
+            self.transports[loop] = transport
+        return await transport.handle_async_request(request)
+
+    async def aclose(self):
+        transport = self.transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+class ModelRegistry:
+    """Model clients shared by the whole process: one client per (provider, model, temperature), and one pool
+    of keep-alive HTTP connections per provider (HTTP/2 when the `h2` package is installed), so calls reuse
+    open connections instead of new TLS handshakes. Pools are given to the providers accepting an HTTP client
+    (openai, groq), other SDKs keep their own pools."""
+
+    logger = Logger()
+    http_client_providers = ['openai', 'groq']
+
+    def __init__(self, pool_size=100, keepalive_expiry=60.0, timeout=600.0):
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.http2 = importlib.util.find_spec('h2') is not None
+        self.models = {}
+        self.http_clients: Dict[str, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+        self.async_transports: Dict[str, EventLoopTransport] = {}
+        self.lock = threading.Lock()
+
+    def get_model(self, model_name, temperature=1.0):
+        provider = get_provider(model_name)
+        key = (provider, model_name, temperature)
+        with self.lock:
+            if key not in self.models:
+                http_client, http_async_client = self.__get_http_clients(provider)
+                self.models[key] = build_model(model_name, temperature, http_client=http_client,
+                                               http_async_client=http_async_client)
+            return self.models[key]
+
+    def __get_http_clients(self, provider):
+        if provider not in self.http_client_providers:
+            return None, None
+        if provider not in self.http_clients:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                                  keepalive_expiry=self.keepalive_expiry)
+            async_transport = self.async_transports[provider] = EventLoopTransport(limits=limits, http2=self.http2)
+            self.http_clients[provider] = (httpx.Client(limits=limits, http2=self.http2, timeout=self.timeout),
+                                           httpx.AsyncClient(transport=async_transport, timeout=self.timeout))
+            self.logger.info(f'HTTP connection pool of {provider}: {self.pool_size} connections'
+                             f'{" (HTTP/2)" if self.http2 else ""}')
+        return self.http_clients[provider]
+
+    async def aclose_loop_connections(self):
+        """Closes async connections opened in the running event loop, before the loop ends"""
+        with self.lock:
+            transports = list(self.async_transports.values())
+        for transport in transports:
+            await transport.aclose()
+
+    def close(self):
+        with self.lock:
+            for http_client, _ in self.http_clients.values():
+                http_client.close()
+            # async connections are closed by the engine at the end of their event loops
+            self.http_clients = {}
+            self.async_transports = {}
+            self.models = {}
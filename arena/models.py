@@ -1,10 +1,6 @@
 import os
 
-from langchain_anthropic import ChatAnthropic
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
-from langchain_mistralai import ChatMistralAI
+# provider packages take seconds to import, each of them is imported only when a model of the provider is built
 
 
 def get_model_name(model):
@@ -13,47 +9,77 @@ def get_model_name(model):
     return model.model_name
 
 
-def get_open_ai_llm(model='gpt-4o', temperature=1.0):
-    llm = ChatOpenAI(model=model, temperature=temperature, openai_api_key=os.getenv('OPENAI_API_KEY'))
+def get_open_ai_llm(model='gpt-4o', temperature=1.0, http_client=None, http_async_client=None):
+    from langchain_openai import ChatOpenAI
+    llm = ChatOpenAI(model=model, temperature=temperature, openai_api_key=os.getenv('OPENAI_API_KEY'),
+                     http_client=http_client, http_async_client=http_async_client)
     return llm
 
 
 def get_claude_llm(model='claude-3-opus-20240229', temperature=1.0):
+    from langchain_anthropic import ChatAnthropic
     llm = ChatAnthropic(model=model, temperature=temperature)
     return llm
 
 
 def get_gemini_llm(model='gemini-pro', temperature=1.0):
+    from langchain_google_genai import ChatGoogleGenerativeAI
     llm = ChatGoogleGenerativeAI(model=model, temperature=temperature)
     return llm
 
 
-def get_llama3(model='llama3-8b-8192', temperature=1.0):
-    llm = ChatGroq(model=model, temperature=temperature)
+def get_llama3(model='llama3-8b-8192', temperature=1.0, http_client=None, http_async_client=None):
+    from langchain_groq import ChatGroq
+    llm = ChatGroq(model=model, temperature=temperature, http_client=http_client, http_async_client=http_async_client)
     return llm
 
 
-def get_mixtral(model='mixtral-8x7b-32768', temperature=1.0):
+def get_mixtral(model='mixtral-8x7b-32768', temperature=1.0, http_client=None, http_async_client=None):
     if 'mixtral-8x7b-32768' in model:
-        llm = ChatGroq(model=model, temperature=temperature)
+        from langchain_groq import ChatGroq
+        llm = ChatGroq(model=model, temperature=temperature, http_client=http_client,
+                       http_async_client=http_async_client)
     else:
+        from langchain_mistralai import ChatMistralAI
         llm = ChatMistralAI(model=model, temperature=temperature)
     return llm
 
 
-def build_model(model_name, temperature=1.0):
-    if 'gpt' in model_name:
-        llm = get_open_ai_llm(model_name, temperature)
+def get_provider(model_name):
+    if model_name.startswith('fake/'):
+        return 'fake'
+    elif 'gpt' in model_name:
+        return 'openai'
+    elif 'claude' in model_name:
+        return 'anthropic'
+    elif 'gemini' in model_name:
+        return 'google'
+    elif 'llama' in model_name or 'gemma' in model_name or 'mixtral-8x7b-32768' in model_name:
+        return 'groq'
+    elif 'mixtral' in model_name:
+        return 'mistral'
+    raise Exception(f'Unknown provider of model "{model_name}"')
+
+
+def build_model(model_name, temperature=1.0, http_client=None, http_async_client=None):
+    # HTTP clients are used by the providers accepting them (openai, groq), others create their own
+    if model_name.startswith('fake/'):
+        from arena.fake_model import FakeChatModel
+        llm = FakeChatModel.from_model_name(model_name, temperature)
+    elif 'gpt' in model_name:
+        llm = get_open_ai_llm(model_name, temperature, http_client, http_async_client)
     elif 'claude' in model_name:
         llm = get_claude_llm(model_name, temperature)
     elif 'gemini' in model_name:
         llm = get_gemini_llm(model_name, temperature)
     elif 'llama' in model_name:
-        llm = get_llama3(model_name, temperature)
+        llm = get_llama3(model_name, temperature, http_client, http_async_client)
     elif 'mixtral' in model_name:
-        llm = get_mixtral(model_name, temperature)
+        llm = get_mixtral(model_name, temperature, http_client, http_async_client)
     elif 'gemma' in model_name:
-        llm = ChatGroq(modle=model_name, temperature=temperature)
+        from langchain_groq import ChatGroq
+        llm = ChatGroq(model=model_name, temperature=temperature, http_client=http_client,
+                       http_async_client=http_async_client)
     else:
         raise Exception(f'Cannot build model "{model_name}"')
     actual_model_name = get_model_name(llm)
@@ -0,0 +1,130 @@
+import random
+from abc import abstractmethod
+from itertools import permutations
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class PairingStrategy:
+    """Chooses (master, student) pairs of a round. Sparse strategies make every model judge and be judged
+    exactly `k` times per round, so a round has k * n_models duels instead of n_models * (n_models - 1)."""
+
+    # pairs of the round depend on current ratings, so rounds are scheduled one by one
+    requires_standings = False
+
+    @abstractmethod
+    def get_pairing_id(self) -> str:
+        pass
+
+    @abstractmethod
+    def get_pairs(self, model_names: List[str], round_num: int,
+                  standings: Optional[np.ndarray] = None) -> List[Tuple[str, str]]:
+        pass
+
+    def get_n_pairs(self, n_models: int) -> int:
+        return n_models * (n_models - 1)
+
+
+class AllPairsPairing(PairingStrategy):
+    """Every model judges every other model in each round"""
+
+    def get_pairing_id(self) -> str:
+        return 'all'
+
+    def get_pairs(self, model_names, round_num, standings=None):
+        return list(permutations(model_names, 2))
+
+
+class ShiftPairing(PairingStrategy):
+    """Models in some order are judged by the models `shift` positions further (cyclically), for k different shifts.
+    Each shift is a permutation without fixed points, so every model judges and is judged once per shift."""
+
+    def __init__(self, k: int):
+        if k < 1:
+            raise Exception(f'Number of duels per model in a round must be positive, got {k}')
+        self.k = k
+
+    def get_n_pairs(self, n_models):
+        return n_models * min(self.k, n_models - 1)
+
+    def get_pairs(self, model_names, round_num, standings=None):
+        n_models = len(model_names)
+        order = self.get_order(model_names, round_num, standings)
+        shifts = self.get_shifts(n_models, round_num)[:min(self.k, n_models - 1)]
+        return [(order[(n + shift) % n_models], order[n]) for shift in shifts for n in range(n_models)]
+
+    @abstractmethod
+    def get_order(self, model_names, round_num, standings) -> List[str]:
+        pass
+
+    @abstractmethod
+    def get_shifts(self, n_models, round_num) -> List[int]:
+        pass
+
+
+class RandomRegularPairing(ShiftPairing):
+    """Random k-regular judge graph, drawn again for each round"""
+
+    def get_pairing_id(self):
+        return 'random_regular'
+
+    def get_order(self, model_names, round_num, standings):
+        return random.sample(model_names, len(model_names))
+
+    def get_shifts(self, n_models, round_num):
+        return random.sample(range(1, n_models), n_models - 1)
+
+
+class BalancedPairing(ShiftPairing):
+    """Balanced incomplete design: rounds take consecutive shifts of a fixed order, so after (n_models - 1) / k
+    rounds every model has judged every other model exactly once, and pairs stay balanced at any point"""
+
+    def get_pairing_id(self):
+        return 'balanced'
+
+    def get_order(self, model_names, round_num, standings):
+        return list(model_names)
+
+    def get_shifts(self, n_models, round_num):
+        first_shift = (round_num - 1) * min(self.k, n_models - 1)
+        return [(first_shift + n) % (n_models - 1) + 1 for n in range(n_models - 1)]
+
+
+class SwissPairing(ShiftPairing):
+    """Swiss system: models are sorted by current ratings and judged by their closest neighbours in the standings
+    (shifts 1, -1, 2, -2, ...). The first round, without standings, is random."""
+
+    requires_standings = True
+
+    def get_pairing_id(self):
+        return 'swiss'
+
+    def get_order(self, model_names, round_num, standings):
+        if standings is None:
+            return random.sample(model_names, len(model_names))
+        return [model_names[n] for n in np.argsort(-standings, kind='stable')]
+
+    def get_shifts(self, n_models, round_num):
+        shifts = []
+        for distance in range(1, n_models):
+            for shift in (distance % n_models, -distance % n_models):
+                if shift not in shifts:
+                    shifts.append(shift)
+        return shifts
+
+
+def get_pairing_ids():
+    return ['all', 'random_regular', 'balanced', 'swiss']
+
+
+def build_pairing(pairing_id: Optional[str], k: Optional[int] = None) -> PairingStrategy:
+    if not pairing_id or pairing_id == 'all':
+        return AllPairsPairing()
+    if k is None:
+        raise Exception(f'Pairing "{pairing_id}" needs a number of duels per model in a round')
+    for pairing_class in [RandomRegularPairing, BalancedPairing, SwissPairing]:
+        pairing = pairing_class(k)
+        if pairing.get_pairing_id() == pairing_id:
+            return pairing
+    raise Exception(f'Unknown pairing id "{pairing_id}"')
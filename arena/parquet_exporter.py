@@ -0,0 +1,122 @@
+import os
+from typing import List, Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
+
+from arena.storage import Storage
+from contests.templates_factory import build_competition_template
+from utils.logger import Logger
+
+
+class ParquetExporter:
+    """Exports an experiment to Parquet files, one directory per table: `duel_result`, `competition_task`
+    and `experiment`, with a file named after the experiment in each of them. Every row has the experiment ID,
+    so files of many experiments are read together as one dataset. Scores of duels are flattened into
+    a float column per metric (`score_<metric>`)."""
+
+    logger = Logger()
+
+    def __init__(self, storage: Storage, experiment_id: str, batch_size=100_000):
+        self.storage = storage
+        self.experiment_id = experiment_id
+        self.batch_size = batch_size
+
+    def export(self, output_dir):
+        experiment = self.storage.get_experiment()
+        if not experiment or not experiment.initialized:
+            raise Exception(f'Experiment "{self.experiment_id}" is not initialized, nothing to export.')
+        metric_keys = build_competition_template(experiment.template_id).get_metric_keys()
+        self.__export_experiment(experiment, output_dir)
+        self.__export_tasks(output_dir)
+        n_results = self.__export_results(metric_keys, output_dir)
+        self.logger.info(f'Exported experiment {self.experiment_id} with {n_results} duel results to {output_dir}')
+
+    def __export_experiment(self, experiment, output_dir):
+        table = pa.table({
+            'experiment_id': [self.experiment_id],
+            'template_id': [experiment.template_id],
+            'created_ts': pa.array([experiment.created_ts], pa.int64()),
+            'model_names': pa.array([experiment.model_names], pa.list_(pa.string())),
+            'n_rounds': pa.array([experiment.n_rounds], pa.int32()),
+            'n_pairs_in_round': pa.array([experiment.n_pairs_in_round], pa.int32()),
+            'n_duels': pa.array([experiment.n_duels], pa.int32()),
+            'pairing': pa.array([experiment.pairing], pa.string()),
+            'pairing_k': pa.array([experiment.pairing_k], pa.int32()),
+            'adaptive': pa.array([bool(experiment.adaptive)], pa.bool_()),
+        })
+        pq.write_table(table, self.__get_path(output_dir, 'experiment'))
+
+    def __export_tasks(self, output_dir):
+        tasks = self.storage.get_tasks()
+        table = pa.table({
+            'experiment_id': pa.array([self.experiment_id] * len(tasks), pa.dictionary(pa.int32(), pa.string())),
+            'task_num': pa.array([task.task_num for task in tasks], pa.int32()),
+            'created_by_model': pa.array([task.created_by_model for task in tasks], pa.string()),
+            'task_description': pa.array([task.task_description for task in tasks], pa.string()),
+        })
+        pq.write_table(table, self.__get_path(output_dir, 'competition_task'))
+
+    def __export_results(self, metric_keys: List[str], output_dir):
+        schema = pa.schema([
+            ('experiment_id', pa.dictionary(pa.int32(), pa.string())),
+            ('id', pa.int64()),
+            ('created_ts', pa.int64()),
+            ('task_num', pa.int32()),
+            ('master_model', pa.dictionary(pa.int32(), pa.string())),
+            ('student_model', pa.dictionary(pa.int32(), pa.string())),
+            ('input_tokens', pa.int32()),
+            ('output_tokens', pa.int32()),
+            ('cost', pa.float64()),
+        ] + [(f'score_{key}', pa.float64()) for key in metric_keys])
+        n_results = 0
+        # rows are streamed from the database and written in record batches, memory doesn't grow with results
+        with pq.ParquetWriter(self.__get_path(output_dir, 'duel_result'), schema) as writer:
+            columns = self.__new_columns(schema)
+            for row in self.storage.iter_results(batch_size=self.batch_size):
+                columns['id'].append(row.id)
+                columns['created_ts'].append(row.created_ts)
+                columns['task_num'].append(row.task_num)
+                columns['master_model'].append(row.master_model)
+                columns['student_model'].append(row.student_model)
+                columns['input_tokens'].append(row.input_tokens)
+                columns['output_tokens'].append(row.output_tokens)
+                columns['cost'].append(row.cost)
+                for key in metric_keys:
+                    columns[f'score_{key}'].append(row.scores_json.get(key))
+                if len(columns['id']) >= self.batch_size:
+                    n_results += self.__write_batch(writer, schema, columns)
+                    columns = self.__new_columns(schema)
+            if columns['id']:
+                n_results += self.__write_batch(writer, schema, columns)
+        return n_results
+
+    def __write_batch(self, writer, schema, columns):
+        n_rows = len(columns['id'])
+        columns['experiment_id'] = [self.experiment_id] * n_rows
+        writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+        return n_rows
+
+    @staticmethod
+    def __new_columns(schema):
+        return {name: [] for name in schema.names}
+
+    def __get_path(self, output_dir, table_name):
+        table_dir = os.path.join(output_dir, table_name)
+        os.makedirs(table_dir, exist_ok=True)
+        return os.path.join(table_dir, f'{self.experiment_id}.parquet')
+
+
+def load_results(output_dir, columns: Optional[List[str]] = None, experiment_ids: Optional[List[str]] = None) -> pa.Table:
+    """Reads duel results of all exported experiments (or the given ones), only with the given columns.
+    Files are memory mapped and only the selected columns are read."""
+    results_dir = os.path.join(output_dir, 'duel_result')
+    file_system = fs.LocalFileSystem(use_mmap=True)
+    paths = sorted(os.path.join(results_dir, name) for name in os.listdir(results_dir) if name.endswith('.parquet'))
+    # experiments of different templates have different metrics, missing score columns are read as nulls
+    schema = pa.unify_schemas([pq.read_schema(path) for path in paths])
+    dataset = ds.dataset(paths, schema=schema, format='parquet', filesystem=file_system)
+    filter_expression = ds.field('experiment_id').isin(experiment_ids) if experiment_ids else None
+    return dataset.to_table(columns=columns, filter=filter_expression)
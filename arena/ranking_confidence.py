@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class RankingConfidence:
+    """Bootstrap of student scores. Every resample weights duel results with Poisson(1) counts, so all resamples
+    are computed with a few matrix products. A pair of models is uncertain when each of them is ranked higher
+    in more than `alpha` / 2 of resamples."""
+
+    def __init__(self, n_models: int, n_bootstrap=200, alpha=0.05, seed=None):
+        self.n_models = n_models
+        self.n_bootstrap = n_bootstrap
+        self.alpha = alpha
+        self.rng = np.random.default_rng(seed)
+
+    def get_bootstrap_means(self, student_indices: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """Mean score of every student in each resample, with shape (n_bootstrap, n_models)"""
+        n_results = len(scores)
+        students = np.zeros((n_results, self.n_models), dtype=np.float32)
+        students[np.arange(n_results), student_indices] = 1.0
+        weighted_scores = students * scores[:, None].astype(np.float32)
+        means = np.full((self.n_bootstrap, self.n_models), np.nan)
+        # resamples are processed in chunks to keep the matrix of weights small
+        chunk_size = max(1, 4_000_000 // max(n_results, 1))
+        for start in range(0, self.n_bootstrap, chunk_size):
+            weights = self.rng.poisson(1.0, (min(chunk_size, self.n_bootstrap - start), n_results)).astype(np.float32)
+            counts = weights @ students
+            sums = weights @ weighted_scores
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[start:start + len(weights)] = np.where(counts > 0, sums / counts, np.nan)
+        return means
+
+    def get_confidence_intervals(self, means: np.ndarray) -> np.ndarray:
+        """Lower and upper bounds of mean scores, with shape (2, n_models)"""
+        return np.nanpercentile(means, [100 * self.alpha / 2, 100 * (1 - self.alpha / 2)], axis=0)
+
+    def get_uncertain_pairs(self, means: np.ndarray) -> np.ndarray:
+        """Boolean matrix of model pairs whose order is not decided yet, models without results are always uncertain"""
+        is_missing = np.isnan(means).any(axis=0)
+        higher = (means[:, :, None] > means[:, None, :]).mean(axis=0)
+        uncertain = np.minimum(higher, higher.T) > self.alpha / 2
+        uncertain |= is_missing[:, None] | is_missing[None, :]
+        np.fill_diagonal(uncertain, False)
+        return uncertain
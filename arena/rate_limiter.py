@@ -0,0 +1,154 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from utils.logger import Logger
+
+
+class TokenBucket:
+    """Token bucket refilled continuously up to `capacity` units per minute.
+    Consumers reserve units upfront and get back the time they need to wait, so the bucket may go into debt
+    and callers are served in the order of their reservations."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.tokens = capacity
+        self.updated_ts = time.monotonic()
+
+    def reserve(self, amount: float, rate_factor: float = 1.0) -> float:
+        ts = time.monotonic()
+        rate = self.rate * rate_factor
+        self.tokens = min(self.capacity, self.tokens + (ts - self.updated_ts) * rate)
+        self.updated_ts = ts
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / rate
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+
+class ProviderLimit:
+    """Requests-per-minute and tokens-per-minute budgets of a single provider. Rate limit errors reported by the
+    provider halve the effective rate, which then recovers slowly with every successful call. The rate is halved
+    at most once per refill of a request, so a burst of errors of concurrent calls counts as one."""
+
+    min_rate_factor = 0.1
+    recovery_step = 0.02
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None, completion_tokens: int = 512):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.completion_tokens = completion_tokens
+        self.rate_factor = 1.0
+        self.reduced_ts = None
+        self.lock = threading.Lock()
+
+    def reserve(self, n_tokens: int) -> float:
+        with self.lock:
+            delay = 0.0
+            if self.requests:
+                delay = max(delay, self.requests.reserve(1, self.rate_factor))
+            if self.tokens:
+                delay = max(delay, self.tokens.reserve(n_tokens, self.rate_factor))
+            return delay
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        if not self.tokens:
+            return
+        with self.lock:
+            self.tokens.refund(estimated_tokens - actual_tokens)
+
+    def on_rate_limited(self) -> bool:
+        """Slows down the provider, returns False when it has been just slowed down by another call"""
+        with self.lock:
+            ts = time.monotonic()
+            if self.reduced_ts is not None and ts - self.reduced_ts < self.__get_refill_time():
+                return False
+            self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+            self.reduced_ts = ts
+            for bucket in (self.requests, self.tokens):
+                if bucket:
+                    bucket.drain()
+            return True
+
+    def __get_refill_time(self):
+        # time to refill the budget of one request at the current rate
+        if self.requests:
+            return 1.0 / (self.requests.rate * self.rate_factor)
+        if self.tokens:
+            return self.completion_tokens / (self.tokens.rate * self.rate_factor)
+        return 0.0
+
+    def on_success(self):
+        if self.rate_factor < 1.0:
+            with self.lock:
+                self.rate_factor = min(1.0, self.rate_factor + self.recovery_step)
+
+
+class RateLimiter:
+    """Proactive rate limiter shared by all duel workers. Limits are defined per provider (see `get_provider`)
+    as a map, e.g. {"openai": {"rpm": 500, "tpm": 200000}, "groq": {"rpm": 30, "tpm": 6000}}.
+    Providers without limits are not throttled. Budgets are per process, with many workers sharing an experiment
+    every one gets a part of them (`n_workers`)."""
+
+    logger = Logger()
+
+    def __init__(self, limits: Dict[str, Dict[str, int]], n_workers=1):
+        self.limits = {provider: ProviderLimit(**self.__get_worker_limit(limit, n_workers))
+                       for provider, limit in limits.items()}
+
+    @staticmethod
+    def from_json_file(file_name, n_workers=1):
+        with open(file_name, 'r') as file:
+            return RateLimiter(json.load(file), n_workers)
+
+    @staticmethod
+    def __get_worker_limit(limit, n_workers):
+        return {key: value / n_workers if key in ('rpm', 'tpm') else value for key, value in limit.items()}
+
+    def is_limited(self, provider: str) -> bool:
+        return provider in self.limits
+
+    def estimate_tokens(self, provider: str, prompt: str) -> int:
+        limit = self.limits.get(provider)
+        completion_tokens = limit.completion_tokens if limit else 0
+        return len(prompt) // 4 + completion_tokens
+
+    def acquire(self, provider: str, n_tokens: int):
+        delay = self.__reserve(provider, n_tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, provider: str, n_tokens: int):
+        delay = self.__reserve(provider, n_tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def settle(self, provider: str, estimated_tokens: int, actual_tokens: Optional[int]):
+        limit = self.limits.get(provider)
+        if limit:
+            limit.on_success()
+            if actual_tokens is not None:
+                limit.settle(estimated_tokens, actual_tokens)
+
+    def on_rate_limited(self, provider: str):
+        limit = self.limits.get(provider)
+        if limit and limit.on_rate_limited():
+            self.logger.info(f'Rate limit reached for {provider}. Slowing down to {limit.rate_factor:.0%} of budget.')
+
+    def __reserve(self, provider, n_tokens):
+        limit = self.limits.get(provider)
+        if not limit:
+            return 0.0
+        delay = limit.reserve(n_tokens)
+        if delay > 1.0:
+            self.logger.debug(f'Throttling {provider} call for {delay:.1f} sec')
+        return delay
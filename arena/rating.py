@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, List
+
+import numpy as np
+
+from arena.score import CompetitionScores
+
+
+class ModelRatings:
+    """Ratings of models corrected for strictness of masters. A score given by master m to student s is modeled
+    for every metric as mean + quality[s] - strictness[m], so harsh or lenient judges don't move the ranking.
+    Ratings are updated online with every duel result (like Elo, with `k_factor` step) and can be refit
+    from aggregated scores of all stored results (least squares with `l2` regularization)."""
+
+    def __init__(self, n_models: int, metric_keys: List[str], k_factor=0.05, l2=1.0):
+        self.n_models = n_models
+        self.metric_keys = list(metric_keys)
+        self.metric_index = {key: n for n, key in enumerate(self.metric_keys)}
+        self.k_factor = k_factor
+        self.l2 = l2
+        self.mean = np.zeros(len(self.metric_keys))
+        self.quality = np.zeros((len(self.metric_keys), n_models))
+        self.strictness = np.zeros((len(self.metric_keys), n_models))
+        self.n_results = 0
+        self.lock = threading.Lock()
+
+    def update(self, master_index: int, student_index: int, score: Dict[str, float]):
+        with self.lock:
+            self.n_results += 1
+            expected = self.mean + self.quality[:, student_index] - self.strictness[:, master_index]
+            actual = expected.copy()
+            for key, value in score.items():
+                if key in self.metric_index:
+                    actual[self.metric_index[key]] = value
+            error = actual - expected
+            self.mean += error / self.n_results
+            self.quality[:, student_index] += self.k_factor * error
+            self.strictness[:, master_index] -= self.k_factor * error
+
+    def refit(self, scores: CompetitionScores, n_iterations=50):
+        """Alternating least squares over sums and counts of master/student cells, for all metrics at once"""
+        sums = scores.scores
+        count = scores.count.astype(np.float64)
+        n_total = count.sum()
+        if n_total == 0:
+            return
+        mean = self.mean.copy()
+        quality = np.zeros_like(self.quality)
+        strictness = np.zeros_like(self.strictness)
+        student_count = count.sum(axis=0) + self.l2
+        master_count = count.sum(axis=1) + self.l2
+        for _ in range(n_iterations):
+            # offsets of all cells are (mean + quality[s] - strictness[m]) * count[m, s]
+            mean = (sums.sum(axis=(1, 2)) - (quality[:, None, :] * count).sum(axis=(1, 2))
+                    + (strictness[:, :, None] * count).sum(axis=(1, 2))) / n_total
+            quality = (sums - (mean[:, None, None] - strictness[:, :, None]) * count).sum(axis=1) / student_count
+            strictness = ((mean[:, None, None] + quality[:, None, :]) * count - sums).sum(axis=2) / master_count
+        with self.lock:
+            self.mean, self.quality, self.strictness = mean, quality, strictness
+            self.n_results = int(n_total)
+
+    def get_ratings(self) -> np.ndarray:
+        """Quality of every model as a student, averaged over metrics"""
+        with self.lock:
+            return self.quality.mean(axis=0)
+
+    def get_strictness(self) -> np.ndarray:
+        """How much lower than average every model scores as a master, averaged over metrics"""
+        with self.lock:
+            return self.strictness.mean(axis=0)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy.orm import sessionmaker
+
+from entities.cached_response import CachedResponse
+from arena.models import get_model_name
+from arena.storage import create_sqlite_engine
+from utils.logger import Logger
+
+
+class CacheMissException(Exception):
+    pass
+
+
+class ResponseCache:
+    """Persistent cache of model responses, stored in the experiment database.
+    Responses are addressed by model name, temperature, rendered prompt and an optional scope,
+    which tells apart independent samples of the same prompt (e.g. different duels). Scopes of duels are stable
+    across experiments (round, master, student and task), so a re-run experiment reuses responses. With
+    `independent_samples` every duel of a new experiment is a new sample, reused only when the duel is resumed.
+
+    Modes:
+    * read_through - return cached response or call the model and store its response,
+    * write_only - always call the model and store its response,
+    * replay_only - return cached response, never call the model (a miss is an error)."""
+
+    logger = Logger()
+    modes = ['read_through', 'write_only', 'replay_only']
+    eviction_interval = 1000
+
+    def __init__(self, db_path, mode='read_through', max_entries: Optional[int] = None,
+                 max_age_sec: Optional[float] = None, independent_samples=False):
+        if mode not in ResponseCache.modes:
+            raise Exception(f'Unknown cache mode "{mode}"')
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_sec = max_age_sec
+        self.independent_samples = independent_samples
+        self.engine = create_sqlite_engine(db_path)
+        CachedResponse.__table__.create(self.engine, checkfirst=True)
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        self.lock = threading.Lock()
+        self.cnt_writes = 0
+        self.cnt_hits = 0
+        self.cnt_misses = 0
+        self.evict()
+
+    @staticmethod
+    def build_key(chat, template, var_dict, scope=None) -> str:
+        prompt = template.format(**var_dict)
+        temperature = getattr(chat, 'temperature', None)
+        key_data = json.dumps([get_model_name(chat), temperature, scope, prompt])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, key) -> Optional[str]:
+        if self.mode == 'write_only':
+            return None
+        with self.SessionLocal() as session:
+            cached = session.get(CachedResponse, key)
+            content = cached.content if cached else None
+        with self.lock:
+            if content is None:
+                self.cnt_misses += 1
+            else:
+                self.cnt_hits += 1
+        if content is None and self.mode == 'replay_only':
+            raise CacheMissException(f'Response {key} not found in cache')
+        return content
+
+    def put(self, key, chat, content: str):
+        cached = CachedResponse()
+        cached.key = key
+        cached.created_ts = time.time_ns() // 1_000
+        cached.model_name = get_model_name(chat)
+        cached.temperature = getattr(chat, 'temperature', None)
+        cached.content = content
+        with self.SessionLocal() as session:
+            session.merge(cached)
+            session.commit()
+        with self.lock:
+            self.cnt_writes += 1
+            run_eviction = self.cnt_writes % ResponseCache.eviction_interval == 0
+        if run_eviction:
+            self.evict()
+
+    def evict(self):
+        with self.SessionLocal() as session:
+            n_deleted = 0
+            if self.max_age_sec:
+                min_ts = (time.time_ns() // 1_000) - int(self.max_age_sec * 1_000_000)
+                n_deleted += session.query(CachedResponse).filter(CachedResponse.created_ts < min_ts).delete()
+            if self.max_entries:
+                n_entries = session.query(CachedResponse).count()
+                if n_entries > self.max_entries:
+                    oldest = (session.query(CachedResponse.key)
+                              .order_by(CachedResponse.created_ts)
+                              .limit(n_entries - self.max_entries))
+                    n_deleted += (session.query(CachedResponse)
+                                  .filter(CachedResponse.key.in_(oldest.scalar_subquery()))
+                                  .delete(synchronize_session=False))
+            session.commit()
+        if n_deleted:
+            self.logger.info(f'Evicted {n_deleted} responses from the cache')
+
+    def show_stats(self):
+        self.logger.info(f'Response cache ({self.mode}): {self.cnt_hits} hits, {self.cnt_misses} misses, '
+                         f'{self.cnt_writes} writes')
@@ -1,3 +1,9 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+from typing import Optional
+
 import matplotlib
 import numpy as np
 matplotlib.use('Agg')
@@ -5,74 +11,132 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 
 from arena.score import CompetitionScores
+from utils.logger import Logger
+
+title_style = {'fontsize': 16, 'fontweight': 'bold'}
+axis_style = {'fontsize': 14, 'fontstyle': 'italic'}
 
 
 class ChartReporter:
-    def __init__(self, competition_id: str, model_names: list, scores: CompetitionScores):
+    """Renders charts of competition scores. Charts are rendered in a pool of processes (or the given `executor`)
+    and a chart is rendered again only when its data, labels or title changed since the last report,
+    according to content hashes kept in `<output_dir>/<competition_id>_charts.json`."""
+
+    logger = Logger()
+
+    def __init__(self, competition_id: str, model_names: list, scores: CompetitionScores, output_dir='workdir',
+                 executor: Optional[concurrent.futures.Executor] = None):
         self.competition_id = competition_id
         self.model_names = model_names
         self.scores = scores
-        self.title_style = {'fontsize': 16, 'fontweight': 'bold'}
-        self.axis_style = {'fontsize': 14, 'fontstyle': 'italic'}
+        self.output_dir = output_dir
+        self.executor = executor
         self.fig_width = max(7, 2 * len(model_names))
 
     def generate_reports(self):
-        all_results = self.scores.get_all_avg_results()
-        metric_keys = all_results.keys()
+        charts = self.__build_charts()
+        hashes_file_name = os.path.join(self.output_dir, f'{self.competition_id}_charts.json')
+        hashes = self.__load_hashes(hashes_file_name)
+        changed_charts = [chart for chart in charts
+                          if hashes.get(chart['file_name']) != chart['hash'] or not os.path.exists(chart['file_name'])]
+        self.logger.info(f'Rendering {len(changed_charts)} charts ({len(charts) - len(changed_charts)} unchanged)')
+        if len(changed_charts) > 1 and self.executor is not None:
+            list(self.executor.map(render_chart, changed_charts))
+        elif len(changed_charts) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(changed_charts), os.cpu_count())) as executor:
+                list(executor.map(render_chart, changed_charts))
+        else:
+            for chart in changed_charts:
+                render_chart(chart)
+        hashes.update({chart['file_name']: chart['hash'] for chart in changed_charts})
+        with open(hashes_file_name, 'w') as file:
+            json.dump(hashes, file, indent=2)
+
+    def __build_charts(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        # arrays of average scores indexed by metric, master and student
+        all_results = self.scores.get_avg_scores()
         student_scores, _ = self.scores.get_student_avg_score_details()
         master_scores, _ = self.scores.get_master_avg_score_details()
-        n_models = len(self.model_names)
-        n_metrics = len(metric_keys)
-        student_overall_scores = np.zeros((n_metrics, n_models))
-        master_overall_scores = np.zeros((n_metrics, n_models))
-        for i, key in enumerate(metric_keys):
-            scores = [score[key] for score in student_scores]
-            student_overall_scores[i] = scores
-            master_overall_scores[i] = [score[key] for score in master_scores]
-            self.generate_overall_results(f'{self.competition_id} / {key}', key,
-                                          f'workdir/{self.competition_id}_{key}.png', scores)
-            self.generate_heatmap_chart(f'{self.competition_id} / {key} (heatmap)',
-                                        f'workdir/{self.competition_id}_{key}_heatmap.png', all_results[key])
-        student_average_scores = student_overall_scores.mean(axis=0)
-        self.generate_overall_results(f'{self.competition_id} / average student result (received)', 'average',
-                                      f'workdir/{self.competition_id}_average_student.png', student_average_scores)
-
-        teacher_average_scores = master_overall_scores.mean(axis=0)
-        self.generate_overall_results(f'{self.competition_id} / average master score (given)', 'average',
-                                      f'workdir/{self.competition_id}_average_master.png', teacher_average_scores)
-
-        x = np.array([all_results[k] for k in all_results])
-        total_heatmap = np.mean(x, axis=0)
-        self.generate_heatmap_chart(f'{self.competition_id} / overall heatmap',
-                                    f'workdir/{self.competition_id}_average_heatmap.png', total_heatmap)
-
-    def generate_heatmap_chart(self, title, file_name, matrix):
-        plt.figure(figsize=(self.fig_width, 6))
-        heatmap = sns.heatmap(matrix, annot=True, cmap="YlGnBu",
-                              xticklabels=self.model_names, yticklabels=self.model_names)
-        heatmap.set_title(title, fontdict=self.title_style)
-        heatmap.set_xlabel('students', fontdict=self.axis_style, labelpad=20)
-        heatmap.set_ylabel('masters', fontdict=self.axis_style)
-        plt.xticks(rotation=-45)
-        plt.subplots_adjust(left=0.2, bottom=0.2)
-
-        plt.tight_layout()
-        plt.savefig(file_name)
-        plt.close()
-
-    def generate_overall_results(self, title, metric_name, file_name, values):
-        plt.figure(figsize=(self.fig_width, 6))
-        bar_plot = sns.barplot(x=self.model_names, y=values, hue=self.model_names, legend=False,
-                               palette=sns.color_palette(n_colors=len(self.model_names)))
-        bar_plot.set_title(title, fontdict=self.title_style)
-        bar_plot.set_xlabel('Models', fontdict=self.axis_style, labelpad=20)
-        bar_plot.set_ylabel(metric_name, fontdict=self.axis_style)
-        for index, value in enumerate(values):
-            bar_plot.text(index, value + 0.01, f'{value:.3f}', color='black', ha="center")
-        plt.subplots_adjust(left=0.2, bottom=0.2)
-        y_min = 0.5 if min(values) > 0.5 else 0.0
-        bar_plot.set_ylim(bottom=y_min)
-
-        plt.tight_layout()
-        plt.savefig(file_name)
-        plt.close()
+        charts = []
+        for i, key in enumerate(self.scores.metric_keys):
+            charts.append(self.__bar_chart(f'{self.competition_id} / {key}', key,
+                                           f'{self.competition_id}_{key}.png', student_scores[i]))
+            charts.append(self.__heatmap_chart(f'{self.competition_id} / {key} (heatmap)',
+                                               f'{self.competition_id}_{key}_heatmap.png', all_results[i]))
+        student_average_scores = student_scores.mean(axis=0)
+        charts.append(self.__bar_chart(f'{self.competition_id} / average student result (received)', 'average',
+                                       f'{self.competition_id}_average_student.png', student_average_scores))
+
+        teacher_average_scores = master_scores.mean(axis=0)
+        charts.append(self.__bar_chart(f'{self.competition_id} / average master score (given)', 'average',
+                                       f'{self.competition_id}_average_master.png', teacher_average_scores))
+
+        total_heatmap = all_results.mean(axis=0)
+        charts.append(self.__heatmap_chart(f'{self.competition_id} / overall heatmap',
+                                           f'{self.competition_id}_average_heatmap.png', total_heatmap))
+        return charts
+
+    def __heatmap_chart(self, title, file_name, matrix):
+        return self.__chart('heatmap', title, None, file_name, matrix)
+
+    def __bar_chart(self, title, metric_name, file_name, values):
+        return self.__chart('bar', title, metric_name, file_name, values)
+
+    def __chart(self, kind, title, metric_name, file_name, values):
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        chart = {'kind': kind, 'title': title, 'metric_name': metric_name, 'model_names': list(self.model_names),
+                 'fig_width': self.fig_width, 'file_name': os.path.join(self.output_dir, file_name)}
+        content = json.dumps({key: value for key, value in chart.items() if key != 'file_name'}, sort_keys=True)
+        chart['hash'] = hashlib.sha256(content.encode('utf-8') + str(values.shape).encode() + values.tobytes()).hexdigest()
+        chart['values'] = values
+        return chart
+
+    @staticmethod
+    def __load_hashes(file_name):
+        if not os.path.exists(file_name):
+            return {}
+        with open(file_name) as file:
+            return json.load(file)
+
+
+def render_chart(chart):
+    if chart['kind'] == 'heatmap':
+        generate_heatmap_chart(chart['title'], chart['file_name'], chart['values'], chart['model_names'],
+                               chart['fig_width'])
+    else:
+        generate_overall_results(chart['title'], chart['metric_name'], chart['file_name'], chart['values'],
+                                 chart['model_names'], chart['fig_width'])
+
+
+def generate_heatmap_chart(title, file_name, matrix, model_names, fig_width):
+    plt.figure(figsize=(fig_width, 6))
+    heatmap = sns.heatmap(matrix, annot=True, cmap="YlGnBu",
+                          xticklabels=model_names, yticklabels=model_names)
+    heatmap.set_title(title, fontdict=title_style)
+    heatmap.set_xlabel('students', fontdict=axis_style, labelpad=20)
+    heatmap.set_ylabel('masters', fontdict=axis_style)
+    plt.xticks(rotation=-45)
+    plt.subplots_adjust(left=0.2, bottom=0.2)
+
+    plt.tight_layout()
+    plt.savefig(file_name)
+    plt.close()
+
+
+def generate_overall_results(title, metric_name, file_name, values, model_names, fig_width):
+    plt.figure(figsize=(fig_width, 6))
+    bar_plot = sns.barplot(x=model_names, y=values, hue=model_names, legend=False,
+                           palette=sns.color_palette(n_colors=len(model_names)))
+    bar_plot.set_title(title, fontdict=title_style)
+    bar_plot.set_xlabel('Models', fontdict=axis_style, labelpad=20)
+    bar_plot.set_ylabel(metric_name, fontdict=axis_style)
+    for index, value in enumerate(values):
+        bar_plot.text(index, value + 0.01, f'{value:.3f}', color='black', ha="center")
+    plt.subplots_adjust(left=0.2, bottom=0.2)
+    y_min = 0.5 if min(values) > 0.5 else 0.0
+    bar_plot.set_ylim(bottom=y_min)
+
+    plt.tight_layout()
+    plt.savefig(file_name)
+    plt.close()
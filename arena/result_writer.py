@@ -0,0 +1,123 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from entities.duel_result import DuelResult
+from entities.duel_state import DuelState
+from arena.job_queue import DuelsQueue
+from arena.metrics import Metrics
+from arena.storage import Storage
+from messages.duel_request_message import DuelRequestMessage
+from utils.logger import Logger
+
+
+class ResultWriter:
+    """Write-behind buffer of duel results. Results are committed in groups, when `batch_size` results are
+    collected or after `max_delay_sec`. Duels of a committed group are acknowledged in the queue together,
+    so a duel is done only when its result is stored. `on_stored` is called for each stored result and
+    `on_failed` for each result of a group which couldn't be committed. States of duels in progress are
+    committed along with the next group too."""
+
+    logger = Logger()
+
+    def __init__(self, storage: Storage, duels_queue: Optional[DuelsQueue] = None, batch_size=16, max_delay_sec=0.5,
+                 on_stored: Optional[Callable[[DuelRequestMessage, DuelResult], None]] = None,
+                 on_failed: Optional[Callable[[DuelRequestMessage, DuelState, BaseException], None]] = None,
+                 metrics: Optional[Metrics] = None):
+        self.storage = storage
+        self.duels_queue = duels_queue
+        self.batch_size = batch_size
+        self.max_delay_sec = max_delay_sec
+        self.on_stored = on_stored
+        self.on_failed = on_failed
+        self.metrics = metrics
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.cnt_commits = 0
+        self.cnt_results = 0
+        self.commit_time = 0.0
+
+    def add(self, result: DuelResult, state: DuelState, message: Optional[DuelRequestMessage] = None):
+        with self.lock:
+            self.buffer.append((result, state, message))
+            is_full = len(self.buffer) >= self.batch_size
+        if is_full:
+            self.flush()
+
+    def add_state(self, state: DuelState):
+        """Adds a copy of the state of a duel in progress (a duel resumed after a crash repeats at most its last
+        phase if it's lost). It never flushes, so it can be called by `on_failed`."""
+        snapshot = DuelState(**{column.name: getattr(state, column.name) for column in DuelState.__table__.columns})
+        with self.lock:
+            self.buffer.append((None, snapshot, None))
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                items, self.buffer = self.buffer, []
+            if not items:
+                return
+            st = time.perf_counter()
+            try:
+                self.storage.save_duel_results([(result, state) for result, state, _ in items])
+            except BaseException as ex:
+                self.logger.error(f'Cannot save {len(items)} duel results and states: {ex}')
+                if self.metrics:
+                    self.metrics.inc('arena_storage_commit_failures_total')
+                self.__complete_failed([item for item in items if item[0] is not None], ex)
+                return
+            finally:
+                commit_time = time.perf_counter() - st
+                self.commit_time += commit_time
+                self.cnt_commits += 1
+                if self.metrics:
+                    self.metrics.observe('arena_storage_commit_seconds', commit_time)
+            items = [item for item in items if item[0] is not None]
+            self.cnt_results += len(items)
+            if self.metrics and items:
+                self.metrics.inc('arena_results_stored_total', len(items))
+            self.__complete_stored(items)
+
+    def __complete_stored(self, items):
+        messages = [message for _, _, message in items if message is not None]
+        try:
+            if self.duels_queue and messages:
+                self.duels_queue.done_many(messages)
+            for result, _, message in items:
+                if self.on_stored:
+                    self.on_stored(message, result)
+        except Exception as ex:
+            self.logger.error(f'Cannot complete stored duels: {ex}')
+
+    def __complete_failed(self, items, error):
+        for _, state, message in items:
+            try:
+                if self.on_failed:
+                    self.on_failed(message, state, error)
+            except Exception as ex:
+                self.logger.error(f'Cannot complete failed duel: {ex}')
+
+    @contextmanager
+    def running(self):
+        """Flushes results periodically in the background and flushes all of them at the end."""
+        stopped = threading.Event()
+
+        def flush_periodically():
+            while not stopped.wait(self.max_delay_sec):
+                self.flush()
+
+        thread = threading.Thread(target=flush_periodically, name='result-writer', daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stopped.set()
+            thread.join()
+            self.flush()
+
+    def show_stats(self):
+        if self.cnt_commits:
+            self.logger.info(f'Stored {self.cnt_results} results in {self.cnt_commits} commits '
+                             f'({1000 * self.commit_time / self.cnt_commits:.1f} ms per commit)')
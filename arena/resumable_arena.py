@@ -1,17 +1,33 @@
+import asyncio
 import concurrent.futures
+import random
 import sqlite3
+import threading
 import time
-from typing import Dict
+from typing import Callable, List, Optional
 
+import numpy as np
+from sqlalchemy.exc import IntegrityError
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from contests.competition_template import CompetitionTemplate
 from entities.duel_result import DuelResult
+from entities.duel_state import DuelState, DuelPhase
+from entities.student_answer import StudentAnswer
+from arena.duel_scheduler import DuelScheduler
+from arena.cost_tracker import CostTracker
 from arena.job_queue import DuelsQueue
+from arena.metrics import Metrics
+from arena.model_registry import ModelRegistry
 from utils.logger import Logger
 from messages.duel_request_message import DuelRequestMessage
-from arena.models import get_model_name
-from arena.score import parse_score, CompetitionScores
+from arena.models import get_model_name, get_provider
+from arena.ranking_confidence import RankingConfidence
+from arena.rate_limiter import RateLimiter
+from arena.rating import ModelRatings
+from arena.response_cache import ResponseCache
+from arena.result_writer import ResultWriter
+from arena.score import parse_score, parse_score_list, CompetitionScores
 from arena.storage import Storage
 from utils.utils import now, wrap
 
@@ -20,10 +36,36 @@ class RetryRequestException(Exception):
     pass
 
 
+class RateLimitException(RetryRequestException):
+    def __init__(self, provider):
+        super().__init__(f'Rate limit reached for {provider}')
+        self.provider = provider
+
+
+backoff = wait_exponential(min=1, max=32)
+
+
+def wait_for_retry(retry_state):
+    # calls throttled by the rate limiter are paced by the provider bucket instead of their own backoff
+    ex = retry_state.outcome.exception()
+    limiter = ResumableArena.rate_limiter
+    if isinstance(ex, RateLimitException) and limiter and limiter.is_limited(ex.provider):
+        return 0.0
+    return backoff(retry_state)
+
+
 class ResumableArena:
     logger = Logger()
+    rate_limiter: Optional[RateLimiter] = None
+    response_cache: Optional[ResponseCache] = None
+    metrics: Optional[Metrics] = None
+    cost_tracker: Optional[CostTracker] = None
+    # prompt | model chains built once for every pair of template and model
+    chains = {}
 
-    def __init__(self, storage: Storage, duels_queue: DuelsQueue, competition_template: CompetitionTemplate, llms):
+    def __init__(self, storage: Storage, duels_queue: DuelsQueue, competition_template: CompetitionTemplate, llms,
+                 next_round: Optional[Callable[['ResumableArena'], bool]] = None,
+                 model_registry: Optional[ModelRegistry] = None):
         self.storage = storage
         self.duels_queue = duels_queue
         self.llms = list(llms)
@@ -34,87 +76,559 @@ class ResumableArena:
         self.model_name_to_index = {get_model_name(llm): n for n, llm in enumerate(self.llms)}
         self.model_name_to_obj = {get_model_name(llm): llm for llm in self.llms}
         self.competition_scores = CompetitionScores(len(llms), self.metric_keys)
+        self.ratings = ModelRatings(len(llms), self.metric_keys)
+        # schedules more duels when the queue is done, returns False when the experiment is complete
+        self.next_round = next_round
+        self.model_registry = model_registry
+        self.answer_locks = {}
+        self.answer_locks_guard = threading.Lock()
+        self.async_answer_locks = {}
+        self.batch_size = 1
+        self.provider_concurrency = None
+        self.prefetch = 8
+        self.gauges_update_ts = 0.0
+        # answers of a batch are generated in parallel by the threads engine, before the single evaluation
+        self.answer_executor = None
+        self.result_writer = self.__build_result_writer(batch_size=1)
 
-    def run(self, n_jobs=1) -> CompetitionScores:
+    def run(self, n_jobs=1, engine='threads', batch_size=1, provider_concurrency=None, prefetch=8,
+            commit_batch=16) -> CompetitionScores:
         start_time = now()
 
-        self.run_duels(n_jobs)
+        self.process_queue(n_jobs, engine, batch_size, provider_concurrency, prefetch, commit_batch)
+        while self.next_round and not self.__is_over_budget() and self.next_round(self):
+            self.process_queue(n_jobs, engine, batch_size, provider_concurrency, prefetch, commit_batch)
         self.generate_results()
 
         total_time = now() - start_time
 
         self.logger.info(f'Done. Total time: {total_time:.1f} sec')
+        self.result_writer.show_stats()
+        if ResumableArena.cost_tracker:
+            ResumableArena.cost_tracker.show_stats()
+        if ResumableArena.response_cache:
+            ResumableArena.response_cache.show_stats()
         self.show_results()
         return self.competition_scores
 
+    def process_queue(self, n_jobs, engine='threads', batch_size=1, provider_concurrency=None, prefetch=8,
+                      commit_batch=16):
+        if batch_size > 1 and self.competition_template.get_batch_answer_evaluation() is None:
+            self.logger.info(f'WARN: {self.template_id} has no batch evaluation template. Evaluating one by one.')
+            batch_size = 1
+        self.batch_size = batch_size
+        self.provider_concurrency = provider_concurrency
+        self.prefetch = prefetch
+        # results are committed in groups, a duel is acknowledged in the queue once its result is stored
+        self.result_writer = self.__build_result_writer(commit_batch)
+        # ratings continue from stored results and are updated live with every new one
+        self.__load_scores()
+        self.ratings.refit(self.competition_scores)
+        if ResumableArena.cost_tracker:
+            ResumableArena.cost_tracker.sync(self.storage.get_total_cost())
+
+        while True:
+            if self.__is_over_budget():
+                self.logger.info(f'Budget reached: {ResumableArena.cost_tracker.get_summary()}. '
+                                 f'{self.duels_queue.queue.qsize()} duels remain in the queue, '
+                                 f'the experiment continues when it is run with a higher budget.')
+                return
+            with self.duels_queue.keep_leases_alive(), self.result_writer.running():
+                if engine == 'async':
+                    self.run_duels_async(n_jobs)
+                else:
+                    self.run_duels(n_jobs)
+            # the last results are stored and their duels acknowledged when the writer stops, done duels are
+            # removed from the queue after that
+            self.duels_queue.prune(include_failed=False)
+            lease_timeout = self.duels_queue.lease_timeout
+            n_leased = self.duels_queue.queue.qsize()
+            if self.__is_over_budget():
+                continue
+            if not lease_timeout or n_leased == 0:
+                return
+            # remaining duels are leased by other workers, wait until they are done or their leases expire
+            self.logger.info(f'Waiting for {n_leased} duels processed by other workers...')
+            time.sleep(lease_timeout / 3)
+            self.duels_queue.cnt_retried = 0
+
+    def __build_result_writer(self, batch_size):
+        return ResultWriter(self.storage, self.duels_queue, batch_size=batch_size,
+                            on_stored=self.__on_result_stored, on_failed=self.__on_result_failed,
+                            metrics=ResumableArena.metrics)
+
     def run_duels(self, n_jobs):
         self.logger.info('Starting duels')
+        self.__prepare_queue()
+        scheduler = self.__build_scheduler()
+        running = set()
+        last_update_ts = 0.0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs * self.batch_size) as answer_executor:
+            self.answer_executor = answer_executor
+            while True:
+                last_update_ts = self.__log_queue_size(last_update_ts, scheduler)
+                self.__update_gauges(scheduler, len(running))
+                paused = self.__pause_if_over_budget(scheduler, running)
+                # a new duel is leased only when a worker is free, completion of a duel drives the next one
+                group = scheduler.next_group(n_jobs - len(running)) if len(running) < n_jobs and not paused else None
+                if group is not None:
+                    future = executor.submit(lambda arg: self.__dispatch_group(arg), group)
+                    future.add_done_callback(lambda _, arg=group: scheduler.release(arg))
+                    running.add(future)
+                    continue
+                if not running and (paused or scheduler.is_exhausted()):
+                    break
+                _, running = concurrent.futures.wait(running, timeout=5.0,
+                                                     return_when=concurrent.futures.FIRST_COMPLETED)
+
+    def run_duels_async(self, max_concurrency):
+        asyncio.run(self.__run_duels_async(max_concurrency))
+
+    async def __run_duels_async(self, max_concurrency):
+        try:
+            await self.__process_duels_async(max_concurrency)
+        finally:
+            # async connections belong to the loop, which ends here, the next part of the queue runs in a new one
+            if self.model_registry:
+                await self.model_registry.aclose_loop_connections()
+
+    async def __process_duels_async(self, max_concurrency):
+        self.logger.info(f'Starting duels (async, max concurrency: {max_concurrency})')
+        # asyncio locks are bound to the event loop, every run of the loop gets its own
+        self.async_answer_locks = {}
+        self.__prepare_queue()
+        scheduler = self.__build_scheduler()
+        running = set()
+        last_update_ts = 0.0
+        stats_ts = 0.0
+        while True:
+            # queue and storage calls block on SQLite, they're run in threads to keep the loop responsive
+            if time.time() - stats_ts >= 1.0:
+                stats_ts = time.time()
+                last_update_ts = await asyncio.to_thread(self.__log_queue_size, last_update_ts, scheduler)
+                await asyncio.to_thread(self.__update_gauges, scheduler, len(running))
+            paused = self.__is_over_budget() and await asyncio.to_thread(self.__pause_if_over_budget, scheduler,
+                                                                         running)
+            group = (await asyncio.to_thread(scheduler.next_group, max_concurrency - len(running))
+                     if len(running) < max_concurrency and not paused else None)
+            if group is not None:
+                task = asyncio.create_task(self.__dispatch_group_async(group))
+                task.add_done_callback(lambda _, arg=group: scheduler.release(arg))
+                running.add(task)
+                continue
+            if not running and (paused or scheduler.is_exhausted()):
+                break
+            _, running = await asyncio.wait(running, timeout=5.0, return_when=asyncio.FIRST_COMPLETED)
+
+    def __build_scheduler(self):
+        return DuelScheduler(lambda: self.__group_messages(self.__get_next_messages()),
+                             prefetch=self.prefetch, provider_concurrency=self.provider_concurrency)
+
+    def __get_next_messages(self) -> List[DuelRequestMessage]:
+        # in batch mode a window of messages is taken, so duels of the same master and task can be grouped
+        window_size = 1 if self.batch_size == 1 else 2 * self.batch_size
+        messages = []
+        while len(messages) < window_size:
+            message = self.duels_queue.get()
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    def __group_messages(self, messages: List[DuelRequestMessage]) -> List[List[DuelRequestMessage]]:
+        if self.batch_size == 1:
+            return [[message] for message in messages]
+        groups = {}
+        for message in messages:
+            groups.setdefault((message.master_model, message.task_num), []).append(message)
+        return [group[i:i + self.batch_size] for group in groups.values()
+                for i in range(0, len(group), self.batch_size)]
+
+    def __prepare_queue(self):
         try:
             self.duels_queue.queue.prune(include_failed=False)
         except sqlite3.OperationalError:
             pass
         self.duels_queue.retry_failed()
         self.duels_queue.retry_locked()
-        futures = []
-        last_update_ts = 0.0
-        with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as executor:
-            all_processed = False
-            while not all_processed:
-                if time.time() - last_update_ts > 5.0:
-                    last_update_ts = time.time()
-                    n_duels_to_done = self.duels_queue.queue.qsize()
-                    self.logger.info(f'Number of pending duels in the queue: {n_duels_to_done}')
-                message = self.duels_queue.get()
-                all_processed = (message is None)
-                if message:
-                    feature = executor.submit(lambda arg: self.__dispatch_duel(arg), message)
-                    futures.append(feature)
-        self.logger.info('Waiting for results...')
-        concurrent.futures.wait(futures)
-        self.duels_queue.prune(include_failed=False)
-        executor.shutdown()
+
+    def __log_queue_size(self, last_update_ts, scheduler: DuelScheduler):
+        if time.time() - last_update_ts > 5.0:
+            n_duels_to_done = self.duels_queue.queue.qsize()
+            self.logger.info(f'Number of pending duels in the queue: {n_duels_to_done} '
+                             f'(in flight: {scheduler.get_in_flight() or "none"})')
+            if ResumableArena.cost_tracker:
+                self.logger.info(f'Cost: {ResumableArena.cost_tracker.get_summary()}')
+            if self.ratings.n_results:
+                self.logger.info(f'Leaderboard: {self.__ratings_to_str(self.ratings.get_ratings(), top=5)}')
+            return time.time()
+        return last_update_ts
+
+    @staticmethod
+    def __is_over_budget():
+        return ResumableArena.cost_tracker is not None and ResumableArena.cost_tracker.is_exceeded()
+
+    def __pause_if_over_budget(self, scheduler: DuelScheduler, running) -> bool:
+        if not self.__is_over_budget():
+            return False
+        # duels leased ahead go back to the queue, duels in flight are completed
+        messages = scheduler.drain()
+        if messages:
+            self.logger.info(f'Budget reached: {ResumableArena.cost_tracker.get_summary()}. Waiting for '
+                             f'{len(running)} running duels, {len(messages)} leased duels are returned to the queue.')
+            self.duels_queue.release_many(messages)
+        return True
+
+    def __update_gauges(self, scheduler: DuelScheduler, n_running):
+        metrics = ResumableArena.metrics
+        if not metrics or time.time() - self.gauges_update_ts < 1.0:
+            return
+        self.gauges_update_ts = time.time()
+        metrics.set('arena_queue_depth', self.duels_queue.queue.qsize())
+        metrics.set('arena_in_flight_groups', n_running)
+        for provider, count in scheduler.get_in_flight_counts().items():
+            metrics.set('arena_in_flight_duels', count, provider=provider)
 
     def generate_results(self):
-        for duel_result in self.storage.get_all_results():
-            master_index = self.model_name_to_index[duel_result.master_model]
-            student_index = self.model_name_to_index[duel_result.student_model]
-            self.competition_scores.update(master_index, student_index, duel_result.scores_json)
+        self.__load_scores()
+        self.ratings.refit(self.competition_scores)
         self.competition_scores.dump(f'./workdir/{self.template_id}_scores.pkl')
 
+    def get_standings(self) -> np.ndarray:
+        """Ratings of models (as students) fitted to all stored results"""
+        self.__load_scores()
+        self.ratings.refit(self.competition_scores)
+        return self.ratings.get_ratings()
+
+    def get_uncertain_models(self) -> List[str]:
+        """Models in pairs whose order in the ranking isn't confident yet, according to bootstrap of stored results.
+        Scores are corrected for strictness of masters before the bootstrap."""
+        self.__load_scores()
+        self.ratings.refit(self.competition_scores)
+        master_indices, student_indices, scores = [], [], []
+        for master_model, student_model, scores_json in self.storage.iter_results(
+                ['master_model', 'student_model', 'scores_json']):
+            if master_model in self.model_name_to_index and student_model in self.model_name_to_index:
+                master_indices.append(self.model_name_to_index[master_model])
+                student_indices.append(self.model_name_to_index[student_model])
+                scores.append(sum(scores_json.get(key, 0.0) for key in self.metric_keys) / len(self.metric_keys))
+        if not scores:
+            return list(self.model_names)
+        master_indices = np.array(master_indices, dtype=np.int64)
+        student_indices = np.array(student_indices, dtype=np.int64)
+        scores = np.array(scores) + self.ratings.get_strictness()[master_indices]
+
+        confidence = RankingConfidence(len(self.llms))
+        means = confidence.get_bootstrap_means(student_indices, scores)
+        lower, upper = confidence.get_confidence_intervals(means)
+        for n in np.argsort(-np.nan_to_num(lower, nan=-np.inf)):
+            self.logger.info(f'   > Model: {self.model_names[n]} score interval: [{lower[n]:.3f}, {upper[n]:.3f}]')
+        uncertain = confidence.get_uncertain_pairs(means)
+        return [self.model_names[n] for n in range(len(self.llms)) if uncertain[n].any()]
+
+    def __load_scores(self):
+        # scores are read from aggregates updated with every stored result, not recomputed from all duels
+        self.competition_scores = CompetitionScores.from_aggregates(self.model_names, self.metric_keys,
+                                                                    self.storage.get_score_aggregates())
+
+    def __dispatch_group(self, messages: List[DuelRequestMessage]):
+        st = now()
+        try:
+            self.__dispatch_messages(messages)
+        finally:
+            self.__record_dispatch(messages, now() - st)
+
+    def __dispatch_messages(self, messages: List[DuelRequestMessage]):
+        if len(messages) == 1:
+            return self.__dispatch_duel(messages[0])
+        duels = list(self.answer_executor.map(self.__answer_batch_duel, messages))
+        duels = [duel for duel in duels if duel is not None]
+        if not duels:
+            return None
+        try:
+            scope, var_dict = self.__build_batch_evaluation(duels)
+            master = self.model_name_to_obj[duels[0][0].master_model]
+            scores_json, usage = self.invoke_chat_with_usage(
+                'Scores', chat=master, template=self.competition_template.get_batch_answer_evaluation(),
+                var_dict=var_dict, log_result=True, cache_scope=scope)
+            self.__complete_batch(duels, scores_json, usage)
+        except BaseException as ex:
+            for message, state, _ in duels:
+                self.__fail_duel(message, state, ex)
+        return None
+
+    async def __dispatch_group_async(self, messages: List[DuelRequestMessage]):
+        st = now()
+        try:
+            await self.__dispatch_messages_async(messages)
+        finally:
+            self.__record_dispatch(messages, now() - st)
+
+    async def __dispatch_messages_async(self, messages: List[DuelRequestMessage]):
+        if len(messages) == 1:
+            return await self.__dispatch_duel_async(messages[0])
+        duels = await asyncio.gather(*[self.__answer_batch_duel_async(message) for message in messages])
+        duels = [duel for duel in duels if duel is not None]
+        if not duels:
+            return None
+        try:
+            scope, var_dict = self.__build_batch_evaluation(duels)
+            master = self.model_name_to_obj[duels[0][0].master_model]
+            scores_json, usage = await self.ainvoke_chat_with_usage(
+                'Scores', chat=master, template=self.competition_template.get_batch_answer_evaluation(),
+                var_dict=var_dict, log_result=True, cache_scope=scope)
+            await asyncio.to_thread(self.__complete_batch, duels, scores_json, usage)
+        except Exception as ex:
+            for message, state, _ in duels:
+                await asyncio.to_thread(self.__fail_duel, message, state, ex)
+        return None
+
+    @staticmethod
+    def __record_dispatch(messages: List[DuelRequestMessage], seconds):
+        if ResumableArena.metrics:
+            for message in messages:
+                ResumableArena.metrics.observe('arena_duel_seconds', seconds, master=message.master_model)
+
     def __dispatch_duel(self, message: DuelRequestMessage):
+        state = None
+        try:
+            student, master = self.__start_duel(message)
+            state = self.__load_duel_state(message)
+            if state.phase == DuelPhase.SCORED:
+                self.duels_queue.mark_done(message)
+                return None
+            answer = self.__get_answer(message, student)
+            self.__mark_answered(state)
+            scores_json, usage = self.invoke_chat_with_usage(
+                'Scores', chat=master, template=self.competition_template.get_answer_evaluation(),
+                var_dict={'task': message.task, 'answer': answer}, log_result=True,
+                cache_scope=self.__get_duel_scope(message))
+            self.__complete_duel(message, state, parse_score(scores_json), usage)
+        except BaseException as ex:
+            self.__fail_duel(message, state, ex)
+            return None
+
+    async def __dispatch_duel_async(self, message: DuelRequestMessage):
+        state = None
         try:
-            student = self.model_name_to_obj[message.student_model]
-            master = self.model_name_to_obj[message.master_model]
-            task = message.task
-            task_num = message.task_num
-
-            self.logger.info('-----------------------------------------------------------------------------')
-            self.logger.info(f'Duel between {get_model_name(master)} (master) '
-                             f'and {get_model_name(student)} (student) on task #{task_num}')
-
-            answer = self.invoke_chat('Answer', chat=student,
-                                      template=self.competition_template.get_question_template(),
-                                      var_dict={'task': task}, log_result=True)
-            scores_json = self.invoke_chat('Scores', chat=master,
-                                           template=self.competition_template.get_answer_evaluation(),
-                                           var_dict={'task': task, 'answer': answer}, log_result=True)
-            scores = parse_score(scores_json)
-
-            self.logger.info(f'Model {get_model_name(student)} scores on task #{task_num}: {scores}')
-
-            duel_result = DuelResult()
-            duel_result.created_ts = time.time_ns() // 1_000
-            duel_result.task_num = task_num
-            duel_result.master_model = get_model_name(master)
-            duel_result.student_model = get_model_name(student)
-            duel_result.scores_json = scores
-            self.storage.save_duel_result(duel_result)
-            self.duels_queue.mark_done(message)
+            student, master = self.__start_duel(message)
+            state = await asyncio.to_thread(self.__load_duel_state, message)
+            if state.phase == DuelPhase.SCORED:
+                await asyncio.to_thread(self.duels_queue.mark_done, message)
+                return None
+            answer = await self.__get_answer_async(message, student)
+            await asyncio.to_thread(self.__mark_answered, state)
+            scores_json, usage = await self.ainvoke_chat_with_usage(
+                'Scores', chat=master, template=self.competition_template.get_answer_evaluation(),
+                var_dict={'task': message.task, 'answer': answer}, log_result=True,
+                cache_scope=self.__get_duel_scope(message))
+            await asyncio.to_thread(self.__complete_duel, message, state, parse_score(scores_json), usage)
+        except Exception as ex:
+            await asyncio.to_thread(self.__fail_duel, message, state, ex)
+            return None
 
+    def __answer_batch_duel(self, message: DuelRequestMessage):
+        state = None
+        try:
+            student, _ = self.__start_duel(message)
+            state = self.__load_duel_state(message)
+            if state.phase == DuelPhase.SCORED:
+                self.duels_queue.mark_done(message)
+                return None
+            answer = self.__get_answer(message, student)
+            self.__mark_answered(state)
+            return message, state, answer
         except BaseException as ex:
-            self.logger.error(f'Error: {ex}')
-            self.duels_queue.mark_failed(message)
+            self.__fail_duel(message, state, ex)
+            return None
+
+    async def __answer_batch_duel_async(self, message: DuelRequestMessage):
+        state = None
+        try:
+            student, _ = self.__start_duel(message)
+            state = await asyncio.to_thread(self.__load_duel_state, message)
+            if state.phase == DuelPhase.SCORED:
+                await asyncio.to_thread(self.duels_queue.mark_done, message)
+                return None
+            answer = await self.__get_answer_async(message, student)
+            await asyncio.to_thread(self.__mark_answered, state)
+            return message, state, answer
+        except Exception as ex:
+            await asyncio.to_thread(self.__fail_duel, message, state, ex)
+            return None
+
+    @staticmethod
+    def __build_batch_evaluation(duels):
+        scope = ','.join(sorted(ResumableArena.__get_duel_scope(message) for message, _, _ in duels))
+        # answers are anonymous and shuffled (in place, deterministically for the same duels) to avoid position bias
+        random.Random(scope).shuffle(duels)
+        answers = '\n\n'.join(f'Answer {n + 1}:\n{answer}' for n, (_, _, answer) in enumerate(duels))
+        return scope, {'task': duels[0][0].task, 'answers': answers, 'n_answers': len(duels)}
+
+    def __complete_batch(self, duels, scores_json, usage):
+        scores_list = parse_score_list(scores_json, len(duels))
+        if scores_list is None:
+            self.__record_parse_failure(duels[0][0].master_model)
+            raise Exception(f'Cannot parse batch scores given by {duels[0][0].master_model}')
+        usages = self.__split_usage(usage, len(duels)) or [None] * len(duels)
+        for (message, state, _), scores, duel_usage in zip(duels, scores_list, usages):
+            try:
+                self.__complete_duel(message, state, scores if isinstance(scores, dict) else None, duel_usage)
+            except BaseException as ex:
+                self.__fail_duel(message, state, ex)
+
+    def __get_answer(self, message: DuelRequestMessage, student):
+        answer_key = self.__get_answer_key(message)
+        with self.answer_locks_guard:
+            lock = self.answer_locks.setdefault(answer_key, threading.Lock())
+        # answer shared by many masters is generated once, by the first duel which needs it
+        with lock:
+            stored_answer = self.__find_stored_answer(message)
+            if stored_answer is not None:
+                return stored_answer
+            answer, usage = self.__ask_student(message, student)
+            return self.__save_answer(message, answer, usage)
+
+    async def __get_answer_async(self, message: DuelRequestMessage, student):
+        lock = self.async_answer_locks.setdefault(self.__get_answer_key(message), asyncio.Lock())
+        async with lock:
+            stored_answer = await asyncio.to_thread(self.__find_stored_answer, message)
+            if stored_answer is not None:
+                return stored_answer
+            answer, usage = await self.__ask_student_async(message, student)
+            return await asyncio.to_thread(self.__save_answer, message, answer, usage)
+
+    @staticmethod
+    def __get_answer_key(message: DuelRequestMessage):
+        # answers not shared with other duels are stored under the key of the duel itself
+        return message.answer_key or f'duel/{message.message_id}'
+
+    @staticmethod
+    def __get_duel_scope(message: DuelRequestMessage):
+        # cached responses of a duel are reused by the same duel of a re-run experiment,
+        # unless the cache keeps independent samples of every duel
+        cache = ResumableArena.response_cache
+        if cache and cache.independent_samples:
+            return str(message.message_id)
+        return f'{message.round_num}/{message.master_model}/{message.student_model}/{message.task_num}'
+
+    @staticmethod
+    def __get_answer_scope(message: DuelRequestMessage):
+        # a shared answer is scoped by its key (round, student and task), other answers by their duel
+        return message.answer_key or ResumableArena.__get_duel_scope(message)
+
+    def __load_duel_state(self, message: DuelRequestMessage) -> DuelState:
+        state = self.storage.get_duel_state(str(message.message_id))
+        if state is None:
+            state = DuelState()
+            state.duel_key = str(message.message_id)
+            state.phase = DuelPhase.PENDING
+            state.answer_key = self.__get_answer_key(message)
+            state.attempts = 0
+        elif state.phase != DuelPhase.PENDING:
+            self.logger.info(f'Resuming duel from phase "{state.phase}" (attempt {state.attempts + 1})')
+        state.attempts += 1
+        state.updated_ts = time.time_ns() // 1_000
+        return state
+
+    def __mark_answered(self, state: DuelState):
+        if state.phase == DuelPhase.PENDING:
+            state.phase = DuelPhase.ANSWERED
+            state.updated_ts = time.time_ns() // 1_000
+            # the answer itself is already stored, the phase is committed with the next group of results
+            self.result_writer.add_state(state)
+
+    def __fail_duel(self, message: DuelRequestMessage, state: Optional[DuelState], ex: BaseException):
+        self.logger.error(f'Error: {ex}')
+        if ResumableArena.metrics:
+            ResumableArena.metrics.inc('arena_duels_total', status='failed')
+        if state is not None:
+            state.last_error = str(ex)
+            state.updated_ts = time.time_ns() // 1_000
+            self.result_writer.add_state(state)
+        self.duels_queue.mark_failed(message)
+
+    def __ask_student(self, message: DuelRequestMessage, student):
+        return self.invoke_chat_with_usage('Answer', chat=student,
+                                           template=self.competition_template.get_question_template(),
+                                           var_dict={'task': message.task}, log_result=True,
+                                           cache_scope=self.__get_answer_scope(message))
+
+    async def __ask_student_async(self, message: DuelRequestMessage, student):
+        return await self.ainvoke_chat_with_usage('Answer', chat=student,
+                                                  template=self.competition_template.get_question_template(),
+                                                  var_dict={'task': message.task}, log_result=True,
+                                                  cache_scope=self.__get_answer_scope(message))
+
+    def __find_stored_answer(self, message: DuelRequestMessage):
+        stored_answer = self.storage.get_answer(self.__get_answer_key(message))
+        if stored_answer is None:
             return None
+        self.logger.info(f'Using stored answer of {message.student_model} on task #{message.task_num}')
+        return stored_answer.answer
+
+    def __save_answer(self, message: DuelRequestMessage, answer, usage):
+        student_answer = StudentAnswer()
+        student_answer.answer_key = self.__get_answer_key(message)
+        student_answer.created_ts = time.time_ns() // 1_000
+        student_answer.round_num = message.round_num
+        student_answer.task_num = message.task_num
+        student_answer.student_model = message.student_model
+        student_answer.answer = answer
+        self.set_usage(student_answer, usage)
+        try:
+            self.storage.save_answer(student_answer)
+        except IntegrityError:
+            # the same answer has been just stored by another worker, use it to keep all duels consistent
+            return self.__find_stored_answer(message)
+        self.mark_stored(student_answer)
+        return answer
+
+    def __start_duel(self, message: DuelRequestMessage):
+        student = self.model_name_to_obj[message.student_model]
+        master = self.model_name_to_obj[message.master_model]
+
+        self.logger.info('-----------------------------------------------------------------------------')
+        self.logger.info(f'Duel between {get_model_name(master)} (master) '
+                         f'and {get_model_name(student)} (student) on task #{message.task_num}')
+        return student, master
+
+    def __complete_duel(self, message: DuelRequestMessage, state: DuelState, scores, usage=None):
+        if scores is None or not all(isinstance(value, (int, float)) for value in scores.values()):
+            self.__record_parse_failure(message.master_model)
+            raise Exception(f'Cannot parse scores given by {message.master_model}')
+
+        self.logger.info(f'Model {message.student_model} scores on task #{message.task_num}: {scores}')
+
+        duel_result = DuelResult()
+        duel_result.created_ts = time.time_ns() // 1_000
+        duel_result.task_num = message.task_num
+        duel_result.master_model = message.master_model
+        duel_result.student_model = message.student_model
+        duel_result.scores_json = scores
+        self.set_usage(duel_result, usage)
+        state.phase = DuelPhase.SCORED
+        state.last_error = None
+        state.updated_ts = duel_result.created_ts
+        self.result_writer.add(duel_result, state, message)
+
+    @staticmethod
+    def __record_parse_failure(master_model):
+        if ResumableArena.metrics:
+            ResumableArena.metrics.inc('arena_parse_failures_total', model=master_model)
+
+    def __on_result_stored(self, message: DuelRequestMessage, duel_result: DuelResult):
+        self.mark_stored(duel_result)
+        if ResumableArena.metrics:
+            ResumableArena.metrics.inc('arena_duels_total', status='scored')
+        self.ratings.update(self.model_name_to_index[message.master_model],
+                            self.model_name_to_index[message.student_model], duel_result.scores_json)
+
+    def __on_result_failed(self, message: DuelRequestMessage, state: DuelState, error: BaseException):
+        # the transaction was rolled back, the answer is kept and only the evaluation is repeated
+        state.phase = DuelPhase.ANSWERED
+        self.__fail_duel(message, state, error)
 
     def show_results(self):
         n_llms = len(self.llms)
@@ -124,9 +638,9 @@ class ResumableArena:
         for n in range(n_llms):
             llm = self.llms[n]
             model_name = get_model_name(llm)
-            avg_scores = student_avg_scores[n]
+            avg_scores = student_avg_scores[:, n]
             cnt_scores = student_scores_cnt[n]
-            if avg_scores:
+            if cnt_scores:
                 self.logger.info(f"   > Model: {model_name} average scores: {self.__score_to_str(avg_scores)}, cnt: {cnt_scores}")
             else:
                 self.logger.info(f"Model: {model_name} - no score")
@@ -135,43 +649,216 @@ class ResumableArena:
         for n in range(n_llms):
             llm = self.llms[n]
             model_name = get_model_name(llm)
-            avg_scores = master_avg_scores[n]
+            avg_scores = master_avg_scores[:, n]
             cnt_scores = master_scores_cnt[n]
-            if avg_scores:
+            if cnt_scores:
                 self.logger.info(f"   > Model: {model_name} average scores: {self.__score_to_str(avg_scores)}, cnt: {cnt_scores}")
             else:
                 self.logger.info(f"Model: {model_name} - no score")
+        self.logger.info(' > ratings corrected for strictness of masters:')
+        self.logger.info(f'   > {self.__ratings_to_str(self.ratings.get_ratings())}')
+        self.logger.info(' > strictness of masters:')
+        self.logger.info(f'   > {self.__ratings_to_str(self.ratings.get_strictness())}')
+
+    def __ratings_to_str(self, ratings: np.ndarray, top=None) -> str:
+        order = np.argsort(-ratings)[:top]
+        return ', '.join(f'{self.model_names[n]}={ratings[n]:+.3f}' for n in order)
+
+    def __score_to_str(self, score: np.ndarray) -> str:
+        return ','.join([f'{key}={value:.3f}' for key, value in zip(self.metric_keys, score)])
+
+    @staticmethod
+    def invoke_chat(name, chat, template, var_dict=None, log_result=True, cache_scope=None):
+        return ResumableArena.invoke_chat_with_usage(name, chat, template, var_dict, log_result, cache_scope)[0]
 
     @staticmethod
-    def __score_to_str(score: Dict[str, float]) -> str:
-        return ','.join([f'{key}={value:.3f}' for key, value in score.items()])
+    async def ainvoke_chat(name, chat, template, var_dict=None, log_result=True, cache_scope=None):
+        result, _ = await ResumableArena.ainvoke_chat_with_usage(name, chat, template, var_dict, log_result,
+                                                                 cache_scope)
+        return result
 
     @staticmethod
-    def invoke_chat(name, chat, template, var_dict=None, log_result=True):
+    def invoke_chat_with_usage(name, chat, template, var_dict=None, log_result=True, cache_scope=None):
+        """Content of the response with tokens and cost of the call (None when the model doesn't report usage)"""
         if var_dict is None:
             var_dict = {}
-        task_selection_chain = template | chat
+        cache = ResumableArena.response_cache
+        cache_key = cache.build_key(chat, template, var_dict, cache_scope) if cache else None
         st = now()
-        response = ResumableArena.__invoke_with_retry(task_selection_chain, var_dict)
+        result = cache.get(cache_key) if cache else None
+        # cached responses cost nothing
+        usage = {'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0}
+        if result is None:
+            chain = ResumableArena.__get_chain(template, chat)
+            provider, n_tokens = ResumableArena.__estimate_request(chat, template, var_dict)
+            try:
+                response = ResumableArena.__invoke_with_retry(chain, var_dict, provider, n_tokens)
+            except BaseException:
+                ResumableArena.__record_call(name, chat, 'error', now() - st)
+                raise
+            result = response.content
+            usage = ResumableArena.__record_usage(chat, response)
+            if cache:
+                cache.put(cache_key, chat, result)
+            ResumableArena.__record_call(name, chat, 'ok', now() - st)
+        else:
+            ResumableArena.__record_call(name, chat, 'cached', now() - st)
         response_time = now() - st
-        result = response.content
         if log_result:
             ResumableArena.logger.debug(f'{name}:\n{wrap(result)}\nTime: {response_time:.1f} sec')
-        return result
+        return result, usage
+
+    @staticmethod
+    async def ainvoke_chat_with_usage(name, chat, template, var_dict=None, log_result=True, cache_scope=None):
+        if var_dict is None:
+            var_dict = {}
+        cache = ResumableArena.response_cache
+        cache_key = cache.build_key(chat, template, var_dict, cache_scope) if cache else None
+        st = now()
+        # the cache is stored in the experiment database, it's read and written in threads
+        result = await asyncio.to_thread(cache.get, cache_key) if cache else None
+        # cached responses cost nothing
+        usage = {'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0}
+        if result is None:
+            chain = ResumableArena.__get_chain(template, chat)
+            provider, n_tokens = ResumableArena.__estimate_request(chat, template, var_dict)
+            try:
+                response = await ResumableArena.__ainvoke_with_retry(chain, var_dict, provider, n_tokens)
+            except BaseException:
+                ResumableArena.__record_call(name, chat, 'error', now() - st)
+                raise
+            result = response.content
+            usage = ResumableArena.__record_usage(chat, response)
+            if cache:
+                await asyncio.to_thread(cache.put, cache_key, chat, result)
+            ResumableArena.__record_call(name, chat, 'ok', now() - st)
+        else:
+            ResumableArena.__record_call(name, chat, 'cached', now() - st)
+        response_time = now() - st
+        if log_result:
+            ResumableArena.logger.debug(f'{name}:\n{wrap(result)}\nTime: {response_time:.1f} sec')
+        return result, usage
+
+    @staticmethod
+    def __record_call(name, chat, status, seconds):
+        metrics = ResumableArena.metrics
+        if not metrics:
+            return
+        model = get_model_name(chat)
+        # calls are named after their purpose: answers of students, scores of masters or tasks
+        role = {'Answer': 'student', 'Scores': 'master'}.get(name, 'task')
+        metrics.inc('arena_calls_total', model=model, role=role, status=status)
+        if status != 'cached':
+            metrics.observe('arena_call_seconds', seconds, model=model, role=role)
+
+    @staticmethod
+    def __record_usage(chat, response):
+        usage = getattr(response, 'usage_metadata', None)
+        if not usage:
+            return None
+        model = get_model_name(chat)
+        input_tokens = usage.get('input_tokens', 0)
+        output_tokens = usage.get('output_tokens', 0)
+        tracker = ResumableArena.cost_tracker
+        cost = tracker.add(model, input_tokens, output_tokens) if tracker else None
+        metrics = ResumableArena.metrics
+        if metrics:
+            metrics.inc('arena_tokens_total', input_tokens, model=model, kind='input')
+            metrics.inc('arena_tokens_total', output_tokens, model=model, kind='output')
+            if cost is not None:
+                metrics.inc('arena_cost_dollars_total', cost, model=model)
+        return {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'cost': cost}
+
+    @staticmethod
+    def set_usage(entity, usage):
+        """Stores tokens and cost of the call which created the entity (task, answer or duel result)"""
+        if usage:
+            entity.input_tokens = usage['input_tokens']
+            entity.output_tokens = usage['output_tokens']
+            entity.cost = usage['cost']
+
+    @staticmethod
+    def mark_stored(entity):
+        """Counts cost of the stored entity in the stored cost of the experiment, see CostTracker.mark_stored"""
+        if ResumableArena.cost_tracker and entity.cost:
+            ResumableArena.cost_tracker.mark_stored(entity.cost)
 
     @staticmethod
-    @retry(stop=stop_after_attempt(20), wait=wait_exponential(min=1, max=32),
+    def __split_usage(usage, n_parts):
+        # a batch evaluation is shared equally by its duels, the first one gets the remainder of tokens
+        if not usage:
+            return []
+        parts = [{'input_tokens': usage['input_tokens'] // n_parts, 'output_tokens': usage['output_tokens'] // n_parts,
+                  'cost': usage['cost'] / n_parts if usage['cost'] is not None else None} for _ in range(n_parts)]
+        parts[0]['input_tokens'] += usage['input_tokens'] % n_parts
+        parts[0]['output_tokens'] += usage['output_tokens'] % n_parts
+        return parts
+
+    @staticmethod
+    def __get_chain(template, chat):
+        # the chain keeps both objects alive, so their ids aren't reused by other objects
+        key = (id(template), id(chat))
+        chain = ResumableArena.chains.get(key)
+        if chain is None:
+            chain = ResumableArena.chains.setdefault(key, template | chat)
+        return chain
+
+    @staticmethod
+    def __estimate_request(chat, template, var_dict):
+        limiter = ResumableArena.rate_limiter
+        provider = get_provider(get_model_name(chat))
+        if not limiter or not limiter.is_limited(provider):
+            return provider, 0
+        return provider, limiter.estimate_tokens(provider, template.format(**var_dict))
+
+    @staticmethod
+    @retry(stop=stop_after_attempt(20), wait=wait_for_retry,
            retry=retry_if_exception_type(RetryRequestException))
-    def __invoke_with_retry(chain, dicts):
+    def __invoke_with_retry(chain, dicts, provider, n_tokens):
+        limiter = ResumableArena.rate_limiter
         try:
+            if limiter:
+                limiter.acquire(provider, n_tokens)
             response = chain.invoke(dicts)
+            if limiter:
+                limiter.settle(provider, n_tokens, ResumableArena.__get_total_tokens(response))
             return response
         except BaseException as ex:
-            message = str(ex)
-            if ('Error code: 429' in message) or ('rate_limit_error' in message):
-                Logger.debug(f'Rate limit error: {message}')
-                raise RetryRequestException()
-            if 'Error code: 503' in message:
-                Logger.debug(f'Service unavailable: {message}')
-                raise RetryRequestException()
-            Logger.error(message)
+            ResumableArena.__handle_invoke_error(ex, provider)
+
+    @staticmethod
+    @retry(stop=stop_after_attempt(20), wait=wait_for_retry,
+           retry=retry_if_exception_type(RetryRequestException))
+    async def __ainvoke_with_retry(chain, dicts, provider, n_tokens):
+        limiter = ResumableArena.rate_limiter
+        try:
+            if limiter:
+                await limiter.acquire_async(provider, n_tokens)
+            response = await chain.ainvoke(dicts)
+            if limiter:
+                limiter.settle(provider, n_tokens, ResumableArena.__get_total_tokens(response))
+            return response
+        except Exception as ex:
+            ResumableArena.__handle_invoke_error(ex, provider)
+
+    @staticmethod
+    def __get_total_tokens(response):
+        usage = getattr(response, 'usage_metadata', None)
+        return usage.get('total_tokens') if usage else None
+
+    @staticmethod
+    def __handle_invoke_error(ex, provider):
+        message = str(ex)
+        if ('Error code: 429' in message) or ('rate_limit_error' in message):
+            Logger.debug(f'Rate limit error: {message}')
+            if ResumableArena.metrics:
+                ResumableArena.metrics.inc('arena_retries_total', provider=provider, reason='rate_limit')
+            if ResumableArena.rate_limiter:
+                ResumableArena.rate_limiter.on_rate_limited(provider)
+            raise RateLimitException(provider)
+        if 'Error code: 503' in message:
+            Logger.debug(f'Service unavailable: {message}')
+            if ResumableArena.metrics:
+                ResumableArena.metrics.inc('arena_retries_total', provider=provider, reason='unavailable')
+            raise RetryRequestException()
+        Logger.error(message)
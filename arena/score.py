@@ -13,46 +13,98 @@ class Score:
 
 
 class CompetitionScores:
-    """Scores archived in the completions. This is a set of 2D arrays for different aspect of evaluation:
-    accuracy, clarity, depth of explanation and reasoning"""
+    """Scores archived in the completions. This is a 3D array of score sums for different aspect of evaluation
+    (accuracy, clarity, depth of explanation and reasoning), indexed by metric, master and student,
+    and a 2D array with number of duels between each master and student"""
 
     def __init__(self, n_models: int, metric_keys: List[str]):
         self.n_models = n_models
-        self.metric_keys = metric_keys
-        self.metrics = {key: np.zeros((n_models, n_models), dtype=np.float32) for key in metric_keys}
-        self.count = np.zeros((n_models, n_models), dtype=np.int32)
+        self.metric_keys = list(metric_keys)
+        self.metric_index = {key: n for n, key in enumerate(self.metric_keys)}
+        self.scores = np.zeros((len(self.metric_keys), n_models, n_models), dtype=np.float64)
+        self.count = np.zeros((n_models, n_models), dtype=np.int64)
+
+    @staticmethod
+    def from_aggregates(model_names: List[str], metric_keys: List[str], aggregates) -> 'CompetitionScores':
+        """Scores built from stored sums and counts of master/student/metric cells (see ScoreAggregate).
+        Aggregates of other models or metrics are skipped."""
+        scores = CompetitionScores(len(model_names), metric_keys)
+        model_index = {model_name: n for n, model_name in enumerate(model_names)}
+        aggregates = [aggregate for aggregate in aggregates if aggregate.metric_key in scores.metric_index
+                      and aggregate.master_model in model_index and aggregate.student_model in model_index]
+        scores.add_aggregates(
+            np.array([model_index[aggregate.master_model] for aggregate in aggregates], dtype=np.int64),
+            np.array([model_index[aggregate.student_model] for aggregate in aggregates], dtype=np.int64),
+            np.array([scores.metric_index[aggregate.metric_key] for aggregate in aggregates], dtype=np.int64),
+            np.array([aggregate.score_sum for aggregate in aggregates], dtype=np.float64),
+            np.array([aggregate.score_count for aggregate in aggregates], dtype=np.int64))
+        return scores
+
+    @staticmethod
+    def from_results(model_names: List[str], metric_keys: List[str], results,
+                     chunk_size=100_000) -> 'CompetitionScores':
+        """Scores built from duel results, rows of master model, student model and scores
+        (see Storage.iter_results), added in chunks with update_many. Results of other models are skipped."""
+        scores = CompetitionScores(len(model_names), metric_keys)
+        model_index = {model_name: n for n, model_name in enumerate(model_names)}
+        master_indices, student_indices, values = [], [], []
+        for master_model, student_model, scores_json in results:
+            if master_model not in model_index or student_model not in model_index:
+                continue
+            master_indices.append(model_index[master_model])
+            student_indices.append(model_index[student_model])
+            values.append([scores_json.get(key, np.nan) for key in scores.metric_keys])
+            if len(values) >= chunk_size:
+                scores.update_many(np.array(master_indices, dtype=np.int64),
+                                   np.array(student_indices, dtype=np.int64), np.array(values, dtype=np.float64))
+                master_indices, student_indices, values = [], [], []
+        if values:
+            scores.update_many(np.array(master_indices, dtype=np.int64),
+                               np.array(student_indices, dtype=np.int64), np.array(values, dtype=np.float64))
+        return scores
+
+    @property
+    def metrics(self) -> Dict[str, np.ndarray]:
+        return {key: self.scores[n] for n, key in enumerate(self.metric_keys)}
 
     def update(self, master_model_index: int, student_model_index: int, score: Dict[str, float]):
         for key, value in score.items():
-            self.metrics[key][master_model_index][student_model_index] += value
-        self.count[master_model_index][student_model_index] += 1
+            self.scores[self.metric_index[key], master_model_index, student_model_index] += value
+        self.count[master_model_index, student_model_index] += 1
+
+    def update_many(self, master_indices: np.ndarray, student_indices: np.ndarray, scores: np.ndarray):
+        """Adds many duels at once. `scores` has a row for each duel and a column for each metric key,
+        missing scores are NaN and count as zero, like missing keys in `update`"""
+        scores = np.nan_to_num(np.asarray(scores, dtype=np.float64))
+        for n in range(len(self.metric_keys)):
+            np.add.at(self.scores[n], (master_indices, student_indices), scores[:, n])
+        np.add.at(self.count, (master_indices, student_indices), 1)
+
+    def add_aggregates(self, master_indices: np.ndarray, student_indices: np.ndarray, metric_indices: np.ndarray,
+                       score_sums: np.ndarray, score_counts: np.ndarray):
+        """Adds sums and counts of scores aggregated for a metric of a master and student pair"""
+        np.add.at(self.scores, (metric_indices, master_indices, student_indices), score_sums)
+        # every duel is scored with all metrics, so the number of duels is the count of any metric
+        np.maximum.at(self.count, (master_indices, student_indices), score_counts)
 
     def dump(self, file_name):
         with open(file_name, 'wb') as file:
             pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def get_all_avg_results(self):
-        count = self.count.copy()
-        count[count == 0.0] = 1.0
-        avg_score = {key: value/count for key, value in self.metrics.items()}
-        return avg_score
+    def get_avg_scores(self) -> np.ndarray:
+        """Average scores with shape (n_metrics, n_masters, n_students)"""
+        return self.scores / np.maximum(self.count, 1)
 
     def get_student_avg_score_details(self):
-        return self.__get_avg_score_details(axis=0)
+        return self.__get_avg_score_details(axis=1)
 
     def get_master_avg_score_details(self):
-        return self.__get_avg_score_details(axis=1)
+        return self.__get_avg_score_details(axis=2)
 
     def __get_avg_score_details(self, axis):
-        count = self.count.sum(axis=axis)
-        count[count == 0.0] = 1.0
-        # mean of every metric type for each model
-        avg_metrics_by_type_and_model = {key: value.sum(axis=axis)/count for key, value in self.metrics.items()}
-        avg_score = []
-        for model in range(self.n_models):
-            avg_scores_for_model = {key: value[model] for key, value in avg_metrics_by_type_and_model.items()}
-            avg_score.append(avg_scores_for_model)
-        return (avg_score, count)
+        """Mean of every metric type for each model, with shape (n_metrics, n_models), and number of duels of models"""
+        count = self.count.sum(axis=axis - 1)
+        return self.scores.sum(axis=axis) / np.maximum(count, 1), count
 
 
 def clean_json_result(json_like):
@@ -72,3 +124,26 @@ def parse_score(raw_json):
     except ValueError:
         Logger.logger.error('Wrong json score:' + raw_json)
     return None
+
+
+def clean_json_list_result(json_like):
+    i1 = json_like.find('[')
+    if i1 < 0:
+        raise Exception('Cannot find json array')
+    i2 = json_like.rfind(']')
+    if i2 < i1:
+        raise Exception('Cannot find json array')
+    return json_like[i1:i2 + 1]
+
+
+def parse_score_list(raw_json, n_scores):
+    raw_json = clean_json_list_result(raw_json)
+    try:
+        scores = json.loads(raw_json)
+    except ValueError:
+        Logger.logger.error('Wrong json scores:' + raw_json)
+        return None
+    if not isinstance(scores, list) or len(scores) != n_scores:
+        Logger.logger.error(f'Expected {n_scores} scores, got: {raw_json}')
+        return None
+    return scores
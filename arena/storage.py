@@ -1,45 +1,200 @@
-from typing import List, Type
+from typing import Iterator, List, Optional, Sequence, Tuple, Type
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Row, create_engine, event, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker
 
 from entities.base import Base
 from entities.competition_task import CompetitionTask
 from entities.duel_result import DuelResult
+from entities.duel_state import DuelState
 from entities.experiment import Experiment
+from entities.scheduled_round import ScheduledRound
+from entities.score_aggregate import ScoreAggregate
+from entities.student_answer import StudentAnswer
+
+
+def create_sqlite_engine(db_path):
+    """Engine shared by many threads and processes: WAL journal lets readers work along with a writer,
+    and writers wait for each other instead of failing with "database is locked"."""
+    engine = create_engine(f'sqlite:///{db_path}', connect_args={'timeout': 60, 'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(connection, _):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute('PRAGMA busy_timeout = 60000')
+        cursor.close()
+
+    return engine
 
 
 class Storage:
+    """Access to the experiment database. Every thread gets its own session,
+    so the storage can be used by all workers at the same time."""
 
     def __init__(self, db_path):
         self.db_path = db_path
-        self.engine = create_engine(f'sqlite:///{db_path}')
+        self.engine = create_sqlite_engine(db_path)
         Base.metadata.create_all(self.engine)
-        self.SessionLocal = sessionmaker(bind=self.engine)
-        self.session = self.SessionLocal()
+        self.__add_missing_columns()
+        # loaded objects stay usable after commit, duel states are passed between worker threads
+        self.SessionLocal = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.session = scoped_session(self.SessionLocal)
+        self.__build_missing_score_aggregates()
 
     def get_experiment(self) -> Experiment:
-        return self.session.query(Experiment).get(0)
+        experiment = self.session.query(Experiment).get(0)
+        self.__release_connection()
+        return experiment
 
-    def save_experiment(self, experiment: Experiment):
+    def save_experiment(self, experiment: Experiment, scheduled_rounds: List[ScheduledRound] = (),
+                        queue_insert: Optional[Tuple[str, List[dict]]] = None):
+        """Saves the experiment with its scheduled rounds and queued duels (see DuelsQueue.get_insert)
+        in one transaction"""
         experiment.id = 0
         self.session.add(experiment)
-        self.session.commit()
+        self.session.add_all(scheduled_rounds)
+        self.__execute_queue_insert(queue_insert)
+        self.__commit()
 
     def delete_experiment(self):
         self.session.query(Experiment).delete()
         self.session.commit()
 
     def get_tasks(self) -> List[Type[CompetitionTask]]:
-        return self.session.query(CompetitionTask).all()
+        tasks = self.session.query(CompetitionTask).order_by(CompetitionTask.task_num, CompetitionTask.id).all()
+        self.__release_connection()
+        return tasks
 
     def save_task(self, task: CompetitionTask):
         self.session.add(task)
-        self.session.commit()
+        self.__commit()
+
+    def get_answer(self, answer_key) -> Optional[StudentAnswer]:
+        answer = self.session.query(StudentAnswer).filter(StudentAnswer.answer_key == answer_key).first()
+        self.__release_connection()
+        return answer
+
+    def save_answer(self, answer: StudentAnswer):
+        self.session.add(answer)
+        self.__commit()
+
+    def get_duel_state(self, duel_key) -> Optional[DuelState]:
+        # the state is detached from the session, it's saved explicitly with save_duel_state
+        state = self.session.get(DuelState, duel_key)
+        if state is not None:
+            self.session.expunge(state)
+        self.__release_connection()
+        return state
+
+    def save_duel_state(self, state: DuelState):
+        self.session.merge(state)
+        self.__commit()
+
+    def save_duel_result(self, result: DuelResult, state: Optional[DuelState] = None):
+        self.save_duel_results([(result, state)])
+
+    def save_duel_results(self, results: List[Tuple[Optional[DuelResult], Optional[DuelState]]]):
+        # results, the states of the duels (final ones, or of duels in progress without a result)
+        # and score aggregates are committed together
+        aggregates = {}
+        for result, state in results:
+            if state is not None:
+                self.session.merge(state)
+            if result is None:
+                continue
+            self.session.add(result)
+            for metric_key, value in result.scores_json.items():
+                key = (result.master_model, result.student_model, metric_key)
+                score_sum, score_count = aggregates.get(key, (0.0, 0))
+                aggregates[key] = (score_sum + value, score_count + 1)
+        if aggregates:
+            statement = insert(ScoreAggregate).values([
+                {'master_model': master_model, 'student_model': student_model, 'metric_key': metric_key,
+                 'score_sum': score_sum, 'score_count': score_count}
+                for (master_model, student_model, metric_key), (score_sum, score_count) in aggregates.items()])
+            statement = statement.on_conflict_do_update(
+                index_elements=['master_model', 'student_model', 'metric_key'],
+                set_={'score_sum': ScoreAggregate.score_sum + statement.excluded.score_sum,
+                      'score_count': ScoreAggregate.score_count + statement.excluded.score_count})
+            self.session.execute(statement)
+        self.__commit()
+
+    def get_scheduled_rounds(self) -> List[Type[ScheduledRound]]:
+        scheduled_rounds = self.session.query(ScheduledRound).order_by(ScheduledRound.round_num).all()
+        self.__release_connection()
+        return scheduled_rounds
+
+    def save_scheduled_round(self, scheduled_round: ScheduledRound,
+                             queue_insert: Optional[Tuple[str, List[dict]]] = None):
+        self.session.add(scheduled_round)
+        self.__execute_queue_insert(queue_insert)
+        self.__commit()
+
+    def __execute_queue_insert(self, queue_insert: Optional[Tuple[str, List[dict]]]):
+        if queue_insert and queue_insert[1]:
+            statement, rows = queue_insert
+            self.session.execute(text(statement), rows)
+
+    def get_score_aggregates(self) -> List[Type[ScoreAggregate]]:
+        aggregates = self.session.query(ScoreAggregate).all()
+        self.__release_connection()
+        return aggregates
+
+    def get_total_cost(self) -> float:
+        """Cost of all stored model calls of the experiment: tasks, answers and evaluations"""
+        total_cost = sum(self.session.query(func.coalesce(func.sum(entity.cost), 0.0)).scalar()
+                         for entity in [CompetitionTask, StudentAnswer, DuelResult])
+        self.__release_connection()
+        return total_cost
+
+    def iter_results(self, columns: Optional[Sequence[str]] = None, batch_size=10_000) -> Iterator[Row]:
+        """Streams duel results as lightweight rows (all columns of duel_result or the given ones),
+        fetching `batch_size` rows at a time, so memory doesn't grow with the number of results"""
+        table = DuelResult.__table__
+        statement = select(*[table.c[column] for column in columns] if columns else [table]).order_by(table.c.id)
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+            yield from result
+
+    def __add_missing_columns(self):
+        # columns added to existing entities are created in databases of older experiments (as nullable)
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    try:
+                        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    except OperationalError as ex:
+                        # another worker has just added it
+                        if 'duplicate column' not in str(ex):
+                            raise
+
+    def __build_missing_score_aggregates(self):
+        # experiments created before score aggregates were introduced have them computed once from all results
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                'INSERT INTO score_aggregate (master_model, student_model, metric_key, score_sum, score_count) '
+                'SELECT r.master_model, r.student_model, s.key, SUM(s.value), COUNT(*) '
+                'FROM duel_result r, json_each(r.scores_json) s '
+                'WHERE NOT EXISTS (SELECT 1 FROM score_aggregate) '
+                'GROUP BY r.master_model, r.student_model, s.key'))
 
-    def save_duel_result(self, result: DuelResult):
-        self.session.add(result)
+    def __release_connection(self):
+        # ends the read transaction, so the thread doesn't hold a pooled connection while it waits for a model
+        # (loaded objects stay usable, they aren't expired on commit)
         self.session.commit()
 
-    def get_all_results(self) -> list[Type[DuelResult]]:
-        return self.session.query(DuelResult).all()
+    def __commit(self):
+        try:
+            self.session.commit()
+        except BaseException:
+            self.session.rollback()
+            raise
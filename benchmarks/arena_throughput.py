@@ -0,0 +1,135 @@
+"""
+End-to-end throughput of the arena with local fake models (see arena/fake_model.py), without any API calls.
+For every number of models a new experiment is built with `ArenaBuilder` and run with `ResumableArena.run`,
+and the benchmark reports duels per second, p50/p99 latency of a duel (from leasing its message to acknowledging it),
+and time spent in the queue and in the storage per duel.
+
+    python -m benchmarks.arena_throughput --models 10 50 100 200 --latency 0.05 --engine async --concurrency 256
+    python -m benchmarks.arena_throughput --models 20 --rate_limit 0.01 --unavailable 0.01 --malformed 0.02
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+from arena.arena_builder import ArenaBuilder
+from arena.job_queue import DuelsQueue
+from arena.storage import Storage
+
+
+class TimedDuelsQueue(DuelsQueue):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.timings_lock = threading.Lock()
+        self.leased_at = {}
+        self.latencies = []
+        self.queue_time = 0.0
+
+    def get(self):
+        st = time.perf_counter()
+        duel_request = super().get()
+        with self.timings_lock:
+            self.queue_time += time.perf_counter() - st
+            if duel_request:
+                self.leased_at[duel_request.message_id] = st
+        return duel_request
+
+    def done_many(self, duel_requests):
+        duel_requests = list(duel_requests)
+        st = time.perf_counter()
+        super().done_many(duel_requests)
+        with self.timings_lock:
+            self.queue_time += time.perf_counter() - st
+            for duel_request in duel_requests:
+                leased_at = self.leased_at.pop(duel_request.message_id, None)
+                if leased_at is not None:
+                    self.latencies.append(st - leased_at)
+
+
+class TimedStorage(Storage):
+    timed_methods = ['get_answer', 'save_answer', 'get_duel_state', 'save_duel_state', 'save_duel_results']
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.timings_lock = threading.Lock()
+        self.storage_time = 0.0
+        for name in self.timed_methods:
+            setattr(self, name, self.__timed(getattr(self, name)))
+
+    def __timed(self, method):
+        def timed_method(*args, **kwargs):
+            st = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self.timings_lock:
+                    self.storage_time += time.perf_counter() - st
+        return timed_method
+
+
+def build_model_names(n_models, args):
+    params = urlencode({'latency': args.latency, 'sigma': args.sigma, 'tokens': args.tokens,
+                        'rate_limit': args.rate_limit, 'unavailable': args.unavailable, 'malformed': args.malformed})
+    return [f'fake/model-{n:03d}?{params}' for n in range(n_models)]
+
+
+def run_experiment(work_dir, n_models, args):
+    db_path = os.path.join(work_dir, f'arena_{n_models}.db')
+    storage = TimedStorage(db_path)
+    duels_queue = TimedDuelsQueue(db_path)
+    st_setup = time.perf_counter()
+    builder = ArenaBuilder(args.rounds, build_model_names(n_models, args), args.template, storage, duels_queue,
+                           pairing=args.pairing, pairing_k=args.pairing_k if args.pairing != 'all' else None)
+    arena = builder.create()
+    setup_time = time.perf_counter() - st_setup
+    # tasks are created during the setup, only duels are timed
+    storage.storage_time = 0.0
+    st = time.perf_counter()
+    arena.run(n_jobs=args.concurrency, engine=args.engine, batch_size=args.batch_evaluation,
+              commit_batch=args.commit_batch)
+    total_time = time.perf_counter() - st
+    latencies = np.array(duels_queue.latencies)
+    n_duels = len(latencies)
+    if n_duels == 0:
+        print(f'{n_models:4d} models: no duels completed')
+        return
+    print(f'{n_models:4d} models: {n_duels} duels in {total_time:.1f} sec (setup {setup_time:.1f} sec), '
+          f'{n_duels / total_time:,.1f} duels/sec, '
+          f'latency p50 {1000 * np.percentile(latencies, 50):.0f} ms, p99 {1000 * np.percentile(latencies, 99):.0f} ms, '
+          f'queue {1000 * duels_queue.queue_time / n_duels:.2f} ms/duel, '
+          f'storage {1000 * storage.storage_time / n_duels:.2f} ms/duel')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the arena end to end with local fake models.')
+    parser.add_argument('--models', type=int, nargs='+', default=[10, 50, 100, 200],
+                        help='Numbers of models of benchmarked experiments (default 10 50 100 200).')
+    parser.add_argument('--template', type=str, default='problem_solving',
+                        help='Competition template (default problem_solving).')
+    parser.add_argument('--rounds', type=int, default=1, help='Number of rounds (default 1).')
+    parser.add_argument('--pairing', type=str, default='random_regular',
+                        help='Pairing of models, "all" gets quadratic in the number of models (default random_regular).')
+    parser.add_argument('--pairing_k', type=int, default=5, help='Duels per model in a round (default 5).')
+    parser.add_argument('--engine', type=str, choices=['threads', 'async'], default='async',
+                        help='Duels execution engine (default async).')
+    parser.add_argument('--concurrency', type=int, default=256, help='Max number of duels in flight (default 256).')
+    parser.add_argument('--batch_evaluation', type=int, default=1,
+                        help='Answers evaluated by a master in one request (default 1).')
+    parser.add_argument('--commit_batch', type=int, default=16, help='Results stored in one transaction (default 16).')
+    parser.add_argument('--latency', type=float, default=0.05, help='Median latency of a model call in seconds.')
+    parser.add_argument('--sigma', type=float, default=0.5, help='Sigma of the log-normal latency distribution.')
+    parser.add_argument('--tokens', type=int, default=200, help='Number of tokens of answers.')
+    parser.add_argument('--rate_limit', type=float, default=0.0, help='Probability of a 429 error of a call.')
+    parser.add_argument('--unavailable', type=float, default=0.0, help='Probability of a 503 error of a call.')
+    parser.add_argument('--malformed', type=float, default=0.0, help='Probability of malformed score JSON.')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # results of the arena are written to ./workdir
+        os.chdir(work_dir)
+        os.makedirs('workdir')
+        for n in args.models:
+            run_experiment(work_dir, n, args)
@@ -0,0 +1,64 @@
+"""
+Import time of the entry points, measured with `python -X importtime` in a fresh interpreter. It fails (exit code 1)
+when an entry point takes longer than the budget to import, or when it imports a module which should be loaded
+only on demand: provider packages (when a model is built) and plotting libraries (when charts are generated).
+
+    python -m benchmarks.import_time --budget_ms 2000
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+lazy_modules = ['langchain_openai', 'langchain_anthropic', 'langchain_google_genai', 'langchain_groq',
+                'langchain_mistralai', 'matplotlib', 'seaborn']
+
+
+def measure_imports(module_name):
+    """Cumulative import time in microseconds of every module imported by the given one, by module name"""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                             capture_output=True, text=True, cwd=os.getcwd())
+    if process.returncode != 0:
+        raise Exception(f'Cannot import {module_name}:\n{process.stderr}')
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time: self [us] | cumulative | imported package
+        _, cumulative_us, name = line.split('|')
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+def check_module(module_name, budget_ms, n_repeats, n_top):
+    # the first run can be slowed down by compiling and caching byte code
+    runs = [measure_imports(module_name) for _ in range(n_repeats + 1)][1:]
+    total_ms = min(times[module_name] for times in runs) / 1000
+    times = runs[0]
+    eager_modules = [name for name in lazy_modules if name in times]
+    top_modules = sorted(((time_us, name) for name, time_us in times.items()
+                          if name != module_name and '.' not in name), reverse=True)[:n_top]
+    print(f'{module_name}: {total_ms:.0f} ms (budget {budget_ms:.0f} ms), slowest imports: '
+          + ', '.join(f'{name} {time_us / 1000:.0f} ms' for time_us, name in top_modules))
+    errors = []
+    if total_ms > budget_ms:
+        errors.append(f'{module_name} is imported in {total_ms:.0f} ms, over the budget of {budget_ms:.0f} ms')
+    if eager_modules:
+        errors.append(f'{module_name} imports {", ".join(eager_modules)} which should be imported on demand')
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check import time of the entry points.')
+    parser.add_argument('--modules', type=str, nargs='+', default=['main', 'worker'],
+                        help='Imported modules (default main worker).')
+    parser.add_argument('--budget_ms', type=float, default=2000, help='Max import time of a module (default 2000).')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of measurements, the best is kept (default 3).')
+    parser.add_argument('--top', type=int, default=5, help='Number of the slowest imports shown (default 5).')
+    args = parser.parse_args()
+    all_errors = []
+    for name in args.modules:
+        all_errors += check_module(name, args.budget_ms, args.repeats, args.top)
+    for error in all_errors:
+        print(f'ERROR: {error}')
+    sys.exit(1 if all_errors else 0)
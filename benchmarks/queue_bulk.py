@@ -0,0 +1,94 @@
+"""
+Enqueueing and acknowledging duels one by one versus in a single transaction.
+
+    python -m benchmarks.queue_bulk --duels 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from arena.job_queue import DuelsQueue
+from arena.storage import Storage
+from entities.experiment import Experiment
+from messages.duel_request_message import DuelRequestMessage
+
+
+def build_requests(n_duels):
+    return [DuelRequestMessage(master_model=f'master-{n % 11}', student_model=f'student-{n % 7}',
+                               template_id='creative_writing', task=f'Task {n % 11}', task_num=n % 11 + 1,
+                               round_num=n // 110 + 1)
+            for n in range(n_duels)]
+
+
+def build_experiment(n_duels):
+    experiment = Experiment()
+    experiment.template_id = 'creative_writing'
+    experiment.model_names = []
+    experiment.created_ts = time.time_ns() // 1_000
+    experiment.n_rounds = 1
+    experiment.n_pairs_in_round = n_duels
+    experiment.n_duels = n_duels
+    experiment.initialized = True
+    return experiment
+
+
+def measure(title, n_duels, action, prepare=None):
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, 'benchmark.db')
+        storage = Storage(db_path)
+        duels_queue = DuelsQueue(db_path)
+        prepared = prepare(duels_queue) if prepare else None
+        st = time.perf_counter()
+        action(storage, duels_queue, prepared)
+        total_time = time.perf_counter() - st
+        n_queued = duels_queue.queue.qsize()
+        del duels_queue
+    print(f'{title:40s} {1000 * total_time:10.1f} ms  ({n_queued} in the queue, {n_duels} duels)')
+
+
+def add_one_by_one(requests):
+    def action(storage, duels_queue, prepared):
+        for request in requests:
+            duels_queue.queue.put(request.json())
+    return action
+
+
+def add_many(requests):
+    def action(storage, duels_queue, prepared):
+        duels_queue.add_many(requests)
+    return action
+
+
+def add_with_experiment(requests):
+    def action(storage, duels_queue, prepared):
+        storage.save_experiment(build_experiment(len(requests)), queue_insert=duels_queue.get_insert(requests))
+    return action
+
+
+def get_all(requests):
+    def prepare(duels_queue):
+        duels_queue.add_many(requests)
+        return [duels_queue.get() for _ in requests]
+    return prepare
+
+
+def done_one_by_one(storage, duels_queue, messages):
+    for message in messages:
+        duels_queue.queue.done(message.message_id)
+
+
+def done_many(storage, duels_queue, messages):
+    duels_queue.done_many(messages)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark bulk operations of the duels queue.')
+    parser.add_argument('--duels', type=int, default=10_000, help='Number of duels (default 10000).')
+    args = parser.parse_args()
+    duel_requests = build_requests(args.duels)
+    measure('add one by one', args.duels, add_one_by_one(duel_requests))
+    measure('add_many', args.duels, add_many(duel_requests))
+    measure('add_many with the experiment record', args.duels, add_with_experiment(duel_requests))
+    measure('done one by one', args.duels, done_one_by_one, get_all(duel_requests))
+    measure('done_many', args.duels, done_many, get_all(duel_requests))
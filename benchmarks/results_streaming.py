@@ -0,0 +1,92 @@
+"""
+Reading all duel results of a synthetic experiment with millions of rows: streamed rows versus ORM objects loaded
+with `.all()`. Each mode runs in a separate process, so the peak memory (max RSS) of every mode is reported.
+
+    python -m benchmarks.results_streaming --results 3000000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sqlite3
+import tempfile
+import time
+
+from arena.storage import Storage
+from entities.duel_result import DuelResult
+
+
+def build_database(db_path, n_results, n_models=50):
+    Storage(db_path)
+    models = [f'model-{n}' for n in range(n_models)]
+    rng = random.Random(0)
+    connection = sqlite3.connect(db_path)
+    chunk_size = 100_000
+    for start in range(0, n_results, chunk_size):
+        rows = []
+        for n in range(start, min(start + chunk_size, n_results)):
+            master_model, student_model = rng.sample(models, 2)
+            scores = {'accuracy': round(rng.random(), 2), 'clarity': round(rng.random(), 2),
+                      'depth': round(rng.random(), 2), 'reasoning': round(rng.random(), 2)}
+            rows.append((n, n % 11 + 1, json.dumps(scores), master_model, student_model))
+        connection.executemany('INSERT INTO duel_result (created_ts, task_num, scores_json, master_model, '
+                               'student_model) VALUES (?, ?, ?, ?, ?)', rows)
+        connection.commit()
+    connection.close()
+    # score aggregates are built when the storage is opened after the results are inserted, not in a measured read
+    Storage(db_path)
+
+
+def read_results(storage: Storage, mode):
+    total = 0.0
+    n_rows = 0
+    if mode == 'stream':
+        for row in storage.iter_results():
+            total += row.scores_json['accuracy']
+            n_rows += 1
+    elif mode == 'columns':
+        for student_model, scores_json in storage.iter_results(['student_model', 'scores_json']):
+            total += scores_json['accuracy']
+            n_rows += 1
+    else:
+        for result in storage.session.query(DuelResult).all():
+            total += result.scores_json['accuracy']
+            n_rows += 1
+    return n_rows
+
+
+def run_mode(db_path, mode, queue):
+    storage = Storage(db_path)
+    st = time.perf_counter()
+    n_rows = read_results(storage, mode)
+    total_time = time.perf_counter() - st
+    # max RSS is in kilobytes on Linux
+    queue.put((n_rows, total_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def measure(db_path, mode):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_mode, args=(db_path, mode, queue))
+    process.start()
+    n_rows, total_time, max_rss_mb = queue.get()
+    process.join()
+    print(f'{mode:8s}: {n_rows} rows in {total_time:.1f} sec, {n_rows / total_time:,.0f} rows/sec, '
+          f'peak memory {max_rss_mb:,.0f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark reading duel results of a large experiment.')
+    parser.add_argument('--results', type=int, default=3_000_000, help='Number of duel results (default 3000000).')
+    parser.add_argument('--modes', type=str, nargs='+', choices=['stream', 'columns', 'orm'],
+                        default=['stream', 'columns', 'orm'],
+                        help='Modes of reading: streamed rows, streamed selected columns, ORM objects with .all().')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'benchmark.db')
+        st_build = time.perf_counter()
+        build_database(path, args.results)
+        print(f'Synthetic experiment with {args.results} results built in {time.perf_counter() - st_build:.1f} sec')
+        for read_mode in args.modes:
+            measure(path, read_mode)
@@ -0,0 +1,96 @@
+"""
+Sustained writes of duel results by concurrent workers sharing the experiment database.
+Every duel writes its state once it's answered and then its result with the final state, both through the
+write-behind buffer, like the arena does.
+
+    python -m benchmarks.storage_writes --threads 8 --processes 2 --duels 200 --commit_batch 1 16 64
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from arena.result_writer import ResultWriter
+from arena.storage import Storage
+from entities.duel_result import DuelResult
+from entities.duel_state import DuelState, DuelPhase
+
+
+def run_duels(writer: ResultWriter, worker_id, n_duels, errors):
+    for n in range(n_duels):
+        try:
+            state = DuelState()
+            state.duel_key = f'{worker_id}/{n}'
+            state.phase = DuelPhase.ANSWERED
+            state.answer_key = f'duel/{worker_id}/{n}'
+            state.attempts = 1
+            state.updated_ts = time.time_ns() // 1_000
+            writer.add_state(state)
+
+            result = DuelResult()
+            result.created_ts = time.time_ns() // 1_000
+            result.task_num = n
+            result.master_model = f'master-{n % 10}'
+            result.student_model = f'student-{n % 7}'
+            result.scores_json = {'accuracy': 0.5, 'clarity': 0.75}
+            state.phase = DuelPhase.SCORED
+            writer.add(result, state)
+        except OperationalError as ex:
+            errors.append(ex)
+
+
+def run_process(db_path, process_id, n_threads, n_duels, commit_batch, queue):
+    storage = Storage(db_path)
+    errors = []
+    writer = ResultWriter(storage, batch_size=commit_batch,
+                          on_failed=lambda message, state, error: errors.append(error))
+    with writer.running():
+        threads = [threading.Thread(target=run_duels,
+                                    args=(writer, f'{process_id}.{n}', n_duels, errors))
+                   for n in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    queue.put(([str(error) for error in errors], writer.cnt_commits))
+
+
+def run_benchmark(n_processes, n_threads, n_duels, commit_batch):
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, 'benchmark.db')
+        Storage(db_path)
+        queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=run_process,
+                                             args=(db_path, n, n_threads, n_duels, commit_batch, queue))
+                     for n in range(n_processes)]
+        st = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        total_time = time.perf_counter() - st
+        n_results = Storage(db_path).session.query(DuelResult).count()
+
+    errors = [error for process_errors, _ in outcomes for error in process_errors]
+    n_locked = sum('database is locked' in error for error in errors)
+    n_commits = sum(cnt_commits for _, cnt_commits in outcomes)
+    print(f'commit_batch={commit_batch:4d}: {n_results} results in {total_time:.1f} sec, '
+          f'{n_results / total_time:.0f} duels/sec, {2 * n_results / total_time:.0f} writes/sec, '
+          f'{n_commits} result commits, errors: {len(errors)} (database is locked: {n_locked})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark concurrent writes to the experiment storage.')
+    parser.add_argument('--processes', type=int, default=2, help='Number of worker processes (default 2).')
+    parser.add_argument('--threads', type=int, default=8, help='Number of threads per process (default 8).')
+    parser.add_argument('--duels', type=int, default=200, help='Number of duels per thread (default 200).')
+    parser.add_argument('--commit_batch', type=int, nargs='+', default=[1, 16, 64],
+                        help='Max number of results committed together, one run per value (default 1 16 64).')
+    args = parser.parse_args()
+    for batch in args.commit_batch:
+        run_benchmark(args.processes, args.threads, args.duels, batch)
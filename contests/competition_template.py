@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import List
+from typing import List, Optional
 
 from langchain_core.prompts import ChatPromptTemplate
 
@@ -28,3 +28,8 @@ class CompetitionTemplate:
     @abstractmethod
     def get_answer_evaluation(self) -> ChatPromptTemplate:
         pass
+
+    def get_batch_answer_evaluation(self) -> Optional[ChatPromptTemplate]:
+        """Template evaluating many answers to the same task in one request (variables: task, answers, n_answers).
+        The response is expected to be a JSON array of score maps, one for each answer."""
+        return None
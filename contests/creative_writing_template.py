@@ -44,6 +44,27 @@ class CreativeWritingTemplate(CompetitionTemplate):
         """)
     ])
 
+    batch_answer_evaluation_template = ChatPromptTemplate.from_messages([
+        ('user', """You are a jury of creative writing competition. 
+        Several people were asked to provide a short story, poem, or descriptive passage not longer than 512 words. 
+        Your goal is to evaluate and score each work independently of the others. 
+        There are three criteria you will evaluate each answer: creativity, emotional depth and narrative flow.
+        The score for each criteria should be a value in range between 0.0 and 1.0. 
+        The output should be just json array with {n_answers} maps, one for each answer in the same order as answers 
+        are presented, containing each criteria and the score value. 
+        Use following keys for the response maps: 'creativity', 'depth', 'flow'.
+        Do not use any formatting in the output - return just JSON array with scores. 
+        Do not output any additional comments regarding the answers.         
+        Example of an output for two answers: 
+        [{{"creativity": 0.61, "depth": 0.82, "flow": 0.55}}, {{"creativity": 0.4, "depth": 0.7, "flow": 0.9}}]  
+
+        Creative writing topic: {task}
+
+        Answers to evaluate: 
+        {answers}
+        """)
+    ])
+
     def get_template_id(self) -> str:
         return 'creative_writing'
 
@@ -61,3 +82,6 @@ class CreativeWritingTemplate(CompetitionTemplate):
 
     def get_answer_evaluation(self) -> ChatPromptTemplate:
         return CreativeWritingTemplate.answer_evaluation_template
+
+    def get_batch_answer_evaluation(self) -> ChatPromptTemplate:
+        return CreativeWritingTemplate.batch_answer_evaluation_template
@@ -47,6 +47,33 @@ class DebateTemplate(CompetitionTemplate):
          """)
     ])
 
+    batch_answer_evaluation_template = ChatPromptTemplate.from_messages([
+        ('user',
+         """You are an expert evaluator assessing the effectiveness of arguments presented in a debate.
+         
+         The thesis you will receive arguments for is: {task}
+         
+         The answers in the competition are: 
+         {answers}
+
+         There are 4 criteria you will evaluate each answer, independently of the others. 
+         Here is the list with its corresponding keys used in the output: 
+         * clarity and structure (key: clarity)
+         * evidence and support (key: evidence)
+         * persuasiveness (key: persuasiveness)
+         * addressing counterarguments (key: anticipation).          
+         
+         The score for each criteria should be a value in range between 0.0 and 1.0. 
+         The output should be just json array with {n_answers} maps, one for each answer in the same order 
+         as answers are presented, containing each criteria key and the score value. 
+         Do not use any formatting in the output - return just JSON array with scores. 
+         Do not output any additional comments regarding the answers.         
+         Example of an output for two answers: 
+         [{{"clarity": 0.61, "evidence": 0.82, "persuasiveness": 0.55, "anticipation": 0.2}}, 
+         {{"clarity": 0.7, "evidence": 0.4, "persuasiveness": 0.65, "anticipation": 0.5}}]  
+         """)
+    ])
+
     def get_template_id(self) -> str:
         return 'debate_persuasion'
 
@@ -63,4 +90,7 @@ class DebateTemplate(CompetitionTemplate):
         return DebateTemplate.problem_question_template
 
     def get_answer_evaluation(self) -> ChatPromptTemplate:
-        return DebateTemplate.answer_evaluation_template
\ No newline at end of file
+        return DebateTemplate.answer_evaluation_template
+
+    def get_batch_answer_evaluation(self) -> ChatPromptTemplate:
+        return DebateTemplate.batch_answer_evaluation_template
@@ -45,6 +45,28 @@ class ProblemSolvingTemplate(CompetitionTemplate):
         """)
     ])
 
+    batch_answer_evaluation_template = ChatPromptTemplate.from_messages([
+        ('user', """You are a jury of problem-solving competition. Several people were asked to solve a problem 
+        and each of them provided a solution (answer). Your goal is to evaluate and score each answer independently 
+        of the others. There are four criteria you will evaluate each answer: accuracy, clarity, depth or explanation 
+        and logical reasoning. 
+        For each criteria provide the score as a value in range between 0.0 and 1.0. 
+        The output should be just json array with {n_answers} maps, one for each answer in the same order as answers 
+        are presented, containing each criteria and the score value. 
+        Use following keys for the response maps: 'accuracy', 'clarity', 'depth', 'reasoning'. 
+        Do not use any formatting in the output. Just pure JSON array. 
+        Do not output any additional comments regarding the answers.         
+        Example of an output for two answers: 
+        [{{"accuracy": 0.8, "clarity": 0.7, "depth": 0.85, "reasoning": 0.75}}, 
+        {{"accuracy": 0.5, "clarity": 0.9, "depth": 0.6, "reasoning": 0.7}}]  
+
+        Problem: {task}
+
+        Problem answers to evaluate: 
+        {answers}
+        """)
+    ])
+
     def get_template_id(self) -> str:
         return 'problem_solving'
 
@@ -62,3 +84,6 @@ class ProblemSolvingTemplate(CompetitionTemplate):
 
     def get_answer_evaluation(self) -> ChatPromptTemplate:
         return ProblemSolvingTemplate.answer_evaluation_template
+
+    def get_batch_answer_evaluation(self) -> ChatPromptTemplate:
+        return ProblemSolvingTemplate.batch_answer_evaluation_template
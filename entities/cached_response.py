@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, String, Float
+
+from entities.base import Base
+
+
+class CachedResponse(Base):
+    __tablename__ = 'response_cache'
+    key = Column(String, primary_key=True)
+    created_ts = Column(Integer, nullable=False, index=True)
+    model_name = Column(String, nullable=False)
+    temperature = Column(Float, nullable=True)
+    content = Column(String, nullable=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Float, Integer, String
 
 from entities.base import Base
 
@@ -8,3 +8,7 @@ class CompetitionTask(Base):
     id = Column(Integer, primary_key=True)
     task_description = Column(String, nullable=False)
     created_by_model = Column(String, nullable=False)
+    task_num = Column(Integer, nullable=True)
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    cost = Column(Float, nullable=True)
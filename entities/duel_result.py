@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, JSON
+from sqlalchemy import Column, Float, Integer, String, JSON
 
 from entities.base import Base
 
@@ -11,3 +11,7 @@ class DuelResult(Base):
     scores_json = Column(JSON, nullable=False)
     master_model = Column(String, nullable=False)
     student_model = Column(String, nullable=False)
+    # usage of the evaluation call, the answer usage is stored with the answer (it may be shared by many duels)
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    cost = Column(Float, nullable=True)
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String
+
+from entities.base import Base
+
+
+class DuelPhase:
+    PENDING = 'pending'
+    ANSWERED = 'answered'
+    SCORED = 'scored'
+
+
+class DuelState(Base):
+    __tablename__ = 'duel_state'
+    duel_key = Column(String, primary_key=True)
+    phase = Column(String, nullable=False, default=DuelPhase.PENDING)
+    answer_key = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    updated_ts = Column(Integer, nullable=False)
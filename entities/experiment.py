@@ -13,3 +13,8 @@ class Experiment(Base):
     n_rounds = Column(Integer, nullable=False)
     n_pairs_in_round = Column(Integer, nullable=False)
     n_duels =  Column(Integer, nullable=False)
+    shared_answers = Column(Boolean, nullable=True)
+    task_per_round = Column(Boolean, nullable=True)
+    adaptive = Column(Boolean, nullable=True)
+    pairing = Column(String, nullable=True)
+    pairing_k = Column(Integer, nullable=True)
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, Integer, JSON
+
+from entities.base import Base
+
+
+class ScheduledRound(Base):
+    __tablename__ = 'scheduled_round'
+    round_num = Column(Integer, primary_key=True)
+    created_ts = Column(Integer, nullable=False)
+    n_duels = Column(Integer, nullable=False)
+    student_models = Column(JSON, nullable=False)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Float, Integer, String
+
+from entities.base import Base
+
+
+class ScoreAggregate(Base):
+    """Running sum and count of a metric given by the master to the student, updated with every stored duel result"""
+    __tablename__ = 'score_aggregate'
+    master_model = Column(String, primary_key=True)
+    student_model = Column(String, primary_key=True)
+    metric_key = Column(String, primary_key=True)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_count = Column(Integer, nullable=False, default=0)
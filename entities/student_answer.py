@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Float, Integer, String
+
+from entities.base import Base
+
+
+class StudentAnswer(Base):
+    __tablename__ = 'student_answer'
+    id = Column(Integer, primary_key=True)
+    answer_key = Column(String, nullable=False, unique=True)
+    created_ts = Column(Integer, nullable=False)
+    round_num = Column(Integer, nullable=True)
+    task_num = Column(Integer, nullable=False)
+    student_model = Column(String, nullable=False)
+    answer = Column(String, nullable=False)
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    cost = Column(Float, nullable=True)
@@ -0,0 +1,29 @@
+import argparse
+
+from arena.parquet_exporter import ParquetExporter
+from arena.storage import Storage
+from utils.logger import Logger
+
+
+class ExperimentExporter:
+    """Exports experiments to Parquet files for analysis (see arena/parquet_exporter.py)."""
+
+    logger = Logger()
+
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Export experiments to Parquet files.")
+        parser.add_argument('--experiment_ids', type=lambda s: s.split(','), required=True,
+                            help="Comma separated list of experiment IDs (required).")
+        parser.add_argument('--output_dir', type=str, default='./workdir/export',
+                            help="Directory of exported files (default ./workdir/export).")
+        self.args = parser.parse_args()
+
+    def run(self):
+        for experiment_id in self.args.experiment_ids:
+            storage = Storage(db_path=f"./{experiment_id}.db")
+            ParquetExporter(storage, experiment_id).export(self.args.output_dir)
+
+
+if __name__ == '__main__':
+    exporter = ExperimentExporter()
+    exporter.run()
@@ -5,12 +5,97 @@ import argparse
 
 from arena.arena_builder import ArenaBuilder
 from contests.templates_factory import get_all_templates
+from arena.cost_tracker import CostTracker
 from arena.job_queue import DuelsQueue
-from arena.result_reporter import ChartReporter
+from arena.metrics import Metrics, MetricsServer
+from arena.model_registry import ModelRegistry
+from arena.pairing import get_pairing_ids
+from arena.rate_limiter import RateLimiter
+from arena.response_cache import ResponseCache
+from arena.resumable_arena import ResumableArena
 from arena.storage import Storage
 from utils.logger import Logger
 
 
+def add_execution_arguments(parser):
+    parser.add_argument('--engine', type=str, choices=['threads', 'async'], default='threads',
+                        help="Duels execution engine: a pool of threads or asyncio event loop (default threads).")
+    parser.add_argument('--concurrency', type=int, required=False,
+                        help="Max number of duels processed at the same time "
+                             "(default: number of models for threads, 256 for async).")
+    parser.add_argument('--rate_limits', type=str, required=False,
+                        help="JSON file with requests/tokens per minute budgets for each provider, "
+                             "e.g. {\"groq\": {\"rpm\": 30, \"tpm\": 6000}}. Budgets are per process.")
+    parser.add_argument('--rate_limit_workers', type=int, default=1,
+                        help="Number of processes (main.py and workers) running the experiment at the same time, "
+                             "each one gets this part of the rate limits (default 1).")
+    parser.add_argument('--cache', type=str, choices=ResponseCache.modes, required=False,
+                        help="Cache model responses in the experiment database (disabled by default).")
+    parser.add_argument('--cache_max_entries', type=int, required=False,
+                        help="Max number of responses kept in the cache.")
+    parser.add_argument('--cache_max_age_days', type=float, required=False,
+                        help="Max age of responses kept in the cache.")
+    parser.add_argument('--cache_independent_samples', action='store_true',
+                        help="Responses of a duel are reused only when it's resumed, not by a new experiment "
+                             "with the same duel.")
+    parser.add_argument('--batch_evaluation', type=int, default=1,
+                        help="Number of answers to the same task evaluated by a master in one request (default 1). "
+                             "New experiment uses the same task for all duels in a round.")
+    parser.add_argument('--provider_concurrency', type=int, required=False,
+                        help="Max number of duels in flight using models of the same provider (default no limit).")
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help="Number of duels leased from the queue ahead of free workers (default 8).")
+    parser.add_argument('--lease_timeout', type=float, required=False,
+                        help="Lease duels for the given number of seconds, renewed while the duel is processed, "
+                             "so many workers can share the experiment (see worker.py).")
+    parser.add_argument('--commit_batch', type=int, default=16,
+                        help="Max number of duel results stored in one transaction (default 16).")
+    parser.add_argument('--prices', type=str, required=False,
+                        help="JSON file with prices in USD per million input and output tokens of models, "
+                             "e.g. {\"gpt-4o\": {\"input\": 2.5, \"output\": 10.0}}, to count cost of the experiment.")
+    parser.add_argument('--budget', type=float, required=False,
+                        help="Max cost of the experiment in USD (needs --prices). Duels are paused when it's reached "
+                             "and remain in the queue.")
+    parser.add_argument('--metrics_port', type=int, required=False,
+                        help="Serve metrics of the running experiment in Prometheus format "
+                             "at http://127.0.0.1:<port>/metrics (disabled by default).")
+    parser.add_argument('--trace_file', type=str, required=False,
+                        help="Append every model call, retry, duel and commit as a JSON line to the file.")
+    parser.add_argument('--http_pool_size', type=int, default=100,
+                        help="Max number of keep-alive HTTP connections to each provider (default 100).")
+
+
+def configure_model_access(args, db_path):
+    ArenaBuilder.model_registry = ModelRegistry(pool_size=args.http_pool_size)
+    if args.prices:
+        ResumableArena.cost_tracker = CostTracker.from_json_file(args.prices, budget=args.budget)
+    elif args.budget is not None:
+        raise Exception('Budget of the experiment needs prices of models (--prices).')
+    if args.rate_limits:
+        ResumableArena.rate_limiter = RateLimiter.from_json_file(args.rate_limits, n_workers=args.rate_limit_workers)
+    if args.cache:
+        max_age_sec = args.cache_max_age_days * 24 * 3600 if args.cache_max_age_days else None
+        ResumableArena.response_cache = ResponseCache(db_path, mode=args.cache,
+                                                      max_entries=args.cache_max_entries,
+                                                      max_age_sec=max_age_sec,
+                                                      independent_samples=args.cache_independent_samples)
+
+
+def configure_metrics(args):
+    if args.metrics_port is None and not args.trace_file:
+        return
+    ResumableArena.metrics = Metrics(trace_file=args.trace_file)
+    if args.metrics_port is not None:
+        MetricsServer(ResumableArena.metrics, args.metrics_port).start()
+
+
+def get_execution_options(args, n_models):
+    n_jobs = args.concurrency or (256 if args.engine == 'async' else n_models)
+    return dict(n_jobs=n_jobs, engine=args.engine, batch_size=args.batch_evaluation,
+                provider_concurrency=args.provider_concurrency, prefetch=args.prefetch,
+                commit_batch=args.commit_batch)
+
+
 class RivaLLMatch:
     model_names = [
         'gpt-4o-2024-08-06',
@@ -38,11 +123,28 @@ class RivaLLMatch:
                             One of values: {[t.get_template_id() for t in get_all_templates()]}""")
         parser.add_argument('--models', type=lambda s: s.split(','),
                             help="List of comma separated LLM model names (required for new experiment).")
+        parser.add_argument('--shared_answers', action='store_true',
+                            help="Generate each student answer once per round and let all masters evaluate it "
+                                 "(applies to new experiment).")
+        parser.add_argument('--adaptive', action='store_true',
+                            help="Schedule rounds one by one, only for models whose ranking is still uncertain, "
+                                 "and stop when the ranking is confident (applies to new experiment).")
+        parser.add_argument('--pairing', type=str, choices=get_pairing_ids(), default='all',
+                            help="How masters and students are paired in a round: all pairs (default), random k-regular "
+                                 "judge graph, balanced incomplete design or Swiss system on current ratings "
+                                 "(applies to new experiment).")
+        parser.add_argument('--pairing_k', type=int, required=False,
+                            help="Number of times each model judges and is judged in a round, for sparse pairings.")
+        parser.add_argument('--task_concurrency', type=int, required=False,
+                            help="Max number of tasks generated at the same time (default: number of models).")
+        add_execution_arguments(parser)
         self.args = parser.parse_args()
         Logger.logger.append_file_logger(f"{self.args.experiment_id}.log")
         self.db_path = f"./{self.args.experiment_id}.db"
         self.storage = Storage(db_path=self.db_path)
-        self.duels_queue = DuelsQueue(db_path=self.db_path)
+        self.duels_queue = DuelsQueue(db_path=self.db_path, lease_timeout=self.args.lease_timeout)
+        configure_model_access(self.args, self.db_path)
+        configure_metrics(self.args)
 
     def run(self):
         model_names = RivaLLMatch.model_names
@@ -52,9 +154,17 @@ class RivaLLMatch:
                               model_names,
                               self.args.template_id,
                               self.storage,
-                              self.duels_queue)
+                              self.duels_queue,
+                              shared_answers=self.args.shared_answers,
+                              task_per_round=self.args.batch_evaluation > 1,
+                              adaptive=self.args.adaptive,
+                              pairing=self.args.pairing,
+                              pairing_k=self.args.pairing_k,
+                              task_concurrency=self.args.task_concurrency)
                  .create())
-        competition_scores = arena.run(n_jobs=n_llms)
+        competition_scores = arena.run(**get_execution_options(self.args, n_llms))
+        # plotting libraries are imported only when charts are generated, workers never need them
+        from arena.result_reporter import ChartReporter
         reporter = ChartReporter(self.args.template_id, model_names, competition_scores)
         reporter.generate_reports()
 
@@ -9,4 +9,6 @@ class DuelRequestMessage(BaseModel):
     template_id: str
     task: str
     task_num: int
+    round_num: Optional[int] = None
+    answer_key: Optional[str] = None
     message_id: Optional[int] = None
@@ -0,0 +1,66 @@
+import argparse
+import concurrent.futures
+import os
+
+from arena.result_reporter import ChartReporter
+from arena.score import CompetitionScores
+from arena.storage import Storage
+from contests.templates_factory import build_competition_template
+from utils.logger import Logger
+
+
+class ReportGenerator:
+    """Generates charts of stored experiments, without running them and without creating model clients.
+    Charts of all experiments are rendered by one pool of processes, unchanged charts are not rendered again."""
+
+    logger = Logger()
+
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Generate charts of stored experiments.")
+        parser.add_argument('--experiment_ids', type=lambda s: s.split(','), required=True,
+                            help="Comma separated list of experiment IDs (required).")
+        parser.add_argument('--output_dir', type=str, default='./workdir',
+                            help="Directory of charts, each experiment gets its own subdirectory (default ./workdir).")
+        parser.add_argument('--n_jobs', type=int, default=os.cpu_count(),
+                            help="Number of processes rendering charts (default: number of CPUs).")
+        parser.add_argument('--from_results', action='store_true',
+                            help="Compute scores from all stored duel results instead of the score aggregates.")
+        self.args = parser.parse_args()
+
+    def run(self):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.args.n_jobs) as executor:
+            for experiment_id in self.args.experiment_ids:
+                self.__generate_reports(experiment_id, executor)
+
+    def __generate_reports(self, experiment_id, executor):
+        storage = Storage(db_path=f"./{experiment_id}.db")
+        experiment = storage.get_experiment()
+        if not experiment or not experiment.initialized:
+            raise Exception(f'Experiment "{experiment_id}" is not initialized, nothing to report.')
+        aggregates = storage.get_score_aggregates()
+        model_names = self.__resolve_model_names(experiment.model_names, aggregates)
+        metric_keys = build_competition_template(experiment.template_id).get_metric_keys()
+        if self.args.from_results:
+            scores = CompetitionScores.from_results(
+                model_names, metric_keys, storage.iter_results(['master_model', 'student_model', 'scores_json']))
+        else:
+            scores = CompetitionScores.from_aggregates(model_names, metric_keys, aggregates)
+        self.logger.info(f'Generating reports of experiment {experiment_id}')
+        reporter = ChartReporter(experiment.template_id, experiment.model_names, scores,
+                                 output_dir=os.path.join(self.args.output_dir, experiment_id), executor=executor)
+        reporter.generate_reports()
+
+    @staticmethod
+    def __resolve_model_names(model_names, aggregates):
+        # results are stored with names resolved by model clients, e.g. 'models/gemini-1.5-pro-latest'
+        stored_names = {aggregate.student_model for aggregate in aggregates}
+        resolved_names = []
+        for model_name in model_names:
+            matching = [name for name in stored_names if name == model_name or name.endswith(f'/{model_name}')]
+            resolved_names.append(matching[0] if matching else model_name)
+        return resolved_names
+
+
+if __name__ == '__main__':
+    generator = ReportGenerator()
+    generator.run()
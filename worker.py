@@ -0,0 +1,50 @@
+import dotenv
+dotenv.load_dotenv()
+
+import argparse
+
+from arena.arena_builder import ArenaBuilder
+from arena.job_queue import DuelsQueue
+from arena.storage import Storage
+from main import add_execution_arguments, configure_metrics, configure_model_access, get_execution_options
+from utils.logger import Logger
+
+
+class DuelsWorker:
+    """Processes duels of an existing experiment. Many workers (processes or hosts sharing the experiment database)
+    can run at the same time - every duel is leased by a single worker and only expired leases are taken over."""
+
+    logger = Logger()
+
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Run a worker processing duels of an existing experiment.")
+        parser.add_argument('--experiment_id', type=str, required=True,
+                            help="Experiment ID (required). The experiment must be created by main.py first.")
+        add_execution_arguments(parser)
+        parser.set_defaults(lease_timeout=120.0)
+        self.args = parser.parse_args()
+        Logger.logger.append_file_logger(f"{self.args.experiment_id}.log")
+        self.db_path = f"./{self.args.experiment_id}.db"
+        self.storage = Storage(db_path=self.db_path)
+        self.duels_queue = DuelsQueue(db_path=self.db_path, lease_timeout=self.args.lease_timeout)
+        configure_model_access(self.args, self.db_path)
+        configure_metrics(self.args)
+
+    def run(self):
+        experiment = self.storage.get_experiment()
+        if not experiment or not experiment.initialized:
+            raise Exception(f'Experiment "{self.args.experiment_id}" is not initialized. '
+                            f'You need to create it with main.py first.')
+        arena = (ArenaBuilder(experiment.n_rounds,
+                              experiment.model_names,
+                              experiment.template_id,
+                              self.storage,
+                              self.duels_queue)
+                 .create())
+        arena.process_queue(**get_execution_options(self.args, len(experiment.model_names)))
+        self.logger.info('No more duels to process.')
+
+
+if __name__ == '__main__':
+    worker = DuelsWorker()
+    worker.run()